@@ -0,0 +1,6 @@
+"""
+Shared code for the Macedonian Stock Exchange scrapers, analysis scripts and services.
+
+The homework folders are run as plain scripts, so each of them puts the repository
+root on sys.path before importing from this package.
+"""
@@ -0,0 +1,155 @@
+"""
+End-to-end scrape throughput benchmark against the offline replay server.
+
+Every target scrapes into its own empty history store, in its own subprocess so peak RSS
+is measured per target, while the parent runs the replay server and counts requests:
+
+    python -m mse.bench Домашнo_1/data --issuers 20 --latency 0.02 --page-size 50 \
+        --targets main1 domashna4 async
+
+Targets:
+    main1       Домашнo_1/main1.py main() (16 threads)
+    domashna4   Домашна_4/main.py fetch_issuer_data() flow, one batch call to annual_data_service
+    async       mse.engine (asyncio, global in-flight budget)
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from mse.replay import ReplayServer, load_corpus
+from mse.storage import HistoryStore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = ["main1", "domashna4", "async"]
+
+
+def _load_script(*parts):
+    path = os.path.join(REPO_ROOT, *parts)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(parts[-1])[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _NullLogArea:
+    """
+    Stands in for the Tk log widget when the Домашна_4 flow runs headless.
+    """
+    def write(self, message):
+        pass
+
+
+def run_target(target, base_url, root):
+    store = HistoryStore(root)
+    if target == "main1":
+        # Note the Latin "o" at the end of the folder name
+        module = _load_script("Домашнo_1", "main1.py")
+        module.BASE_URL = f"{base_url}/mk/stats/symbolhistory/{{}}"
+        module.store = store
+        # Measure the network path, not the response cache
+        module.cache = None
+        module.main()
+    elif target == "domashna4":
+        from werkzeug.serving import make_server
+        # annual_data_service runs in this process, in front of the replay server
+        service = _load_script("Домашна_4", "annual_data_service.py")
+        service.BASE_URL = f"{base_url}/mk/stats/symbolhistory/{{issuer_code}}"
+        service.cache = None
+        server = make_server("127.0.0.1", 0, service.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        module = _load_script("Домашна_4", "main.py")
+        module.BASE_URL = f"{base_url}/{{}}"
+        module.ANNUAL_DATA_URL = f"http://127.0.0.1:{server.server_port}"
+        module.store = store
+        module.fetch_issuer_data(_NullLogArea())
+        server.shutdown()
+    elif target == "async":
+        from mse import engine
+        engine.run(store=store, base_url=f"{base_url}/mk/stats/symbolhistory/{{}}", log=lambda message: None)
+    else:
+        raise ValueError(f"Unknown benchmark target {target!r}")
+
+
+def _child(args):
+    start_time = time.perf_counter()
+    run_target(args.run_target, args.base_url, args.root)
+    wall = time.perf_counter() - start_time
+    rows = sum(entry["rows"] for entry in HistoryStore(args.root).manifest.entries().values())
+    print(json.dumps({"wall": wall, "rows": rows, "peak_rss_mb": peak_rss_mb()}))
+
+
+def benchmark(server, targets):
+    results = []
+    for target in targets:
+        server.stats.reset()
+        with tempfile.TemporaryDirectory() as root:
+            command = [sys.executable, "-m", "mse.bench", "--run-target", target,
+                       "--base-url", server.base_url, "--root", root]
+            completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{target} failed:\n{completed.stderr}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        served = server.stats.snapshot()
+        result.update(target=target, requests=served["requests"], errors=served["errors"])
+        results.append(result)
+    return results
+
+
+def print_report(results):
+    print(f"{'target':>10} {'wall s':>8} {'req/s':>8} {'rows/s':>9} {'rows':>8} {'requests':>9} {'503s':>5} {'peak MB':>8}")
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "n/a"
+        print(f"{r['target']:>10} {r['wall']:>8.2f} {r['requests'] / r['wall']:>8.1f} {r['rows'] / r['wall']:>9.0f} "
+              f"{r['rows']:>8} {r['requests']:>9} {r['errors']:>5} {rss:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against the offline replay server.")
+    parser.add_argument("csv_dir", nargs="?", help="CSV corpus to serve, e.g. Домашнo_1/data")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--issuers", type=int, default=None, help="serve only the first N issuers")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    # Internal: run one target in this process
+    parser.add_argument("--run-target", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_target:
+        _child(args)
+        return
+    if not args.csv_dir:
+        parser.error("csv_dir is required")
+
+    corpus = load_corpus(args.csv_dir, args.issuers)
+    server = ReplayServer(corpus, latency=args.latency, error_rate=args.error_rate, page_size=args.page_size).start()
+    results = benchmark(server, args.targets)
+    server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Persistent on-disk cache of symbolhistory result pages.
+
+Entries are keyed by (issuer, FromDate, ToDate, page) and stored gzipped under
+data/cache/<ISSUER>/. A page fetched after its query's ToDate covers a closed period whose
+history never changes, so it is kept forever. A page fetched while the period was still open
+is only reused for `ttl` seconds, even once the period has ended: it may lack the last days.
+
+    python -m mse.cache list [--issuer ALK]
+    python -m mse.cache evict [--issuer ALK] [--open-only] [--older-than HOURS]
+"""
+import argparse
+import gzip
+import os
+import time
+from datetime import date, datetime
+
+from mse.paths import data_path
+
+DEFAULT_ROOT = data_path("cache")
+DEFAULT_TTL = 6 * 3600
+
+
+def is_closed(to_date, today=None):
+    """
+    True when a query's ToDate ("dd.mm.yyyy") lies before today.
+    """
+    return datetime.strptime(to_date, "%d.%m.%Y").date() < (today or date.today())
+
+
+def is_final(to_date, mtime):
+    """
+    True when a page of a query ending on `to_date` was fetched (`mtime`) after that day.
+    """
+    return is_closed(to_date, today=date.fromtimestamp(mtime))
+
+
+class ResponseCache:
+    def __init__(self, root=DEFAULT_ROOT, ttl=DEFAULT_TTL):
+        self.root = root
+        self.ttl = ttl
+
+    def path(self, issuer, from_date, to_date, page):
+        return os.path.join(self.root, issuer, f"{from_date}_{to_date}_{page}.html.gz")
+
+    def get(self, issuer, from_date, to_date, page):
+        """
+        Return the cached page body, or None when it is missing or has expired.
+        """
+        path = self.path(issuer, from_date, to_date, page)
+        try:
+            mtime = os.path.getmtime(path)
+            if not is_final(to_date, mtime) and time.time() - mtime > self.ttl:
+                return None
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        except (FileNotFoundError, EOFError, gzip.BadGzipFile):
+            return None
+
+    def put(self, issuer, from_date, to_date, page, content):
+        path = self.path(issuer, from_date, to_date, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def get_payload(self, payload, page):
+        return self.get(payload["Code"], payload["FromDate"], payload["ToDate"], page)
+
+    def put_payload(self, payload, page, content):
+        self.put(payload["Code"], payload["FromDate"], payload["ToDate"], page, content)
+
+    def entries(self, issuer=None):
+        """
+        Yield a dict describing every cached page.
+        """
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        for code in sorted(os.listdir(self.root)):
+            if issuer and code != issuer:
+                continue
+            directory = os.path.join(self.root, code)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".html.gz"):
+                    continue
+                from_date, to_date, page = name[:-len(".html.gz")].split("_")
+                path = os.path.join(directory, name)
+                mtime = os.path.getmtime(path)
+                age = now - mtime
+                closed = is_final(to_date, mtime)
+                yield {
+                    "issuer": code, "from": from_date, "to": to_date, "page": int(page), "path": path,
+                    "size": os.path.getsize(path), "age": age, "closed": closed,
+                    "expired": not closed and age > self.ttl,
+                }
+
+    def evict(self, issuer=None, open_only=False, older_than=None):
+        """
+        Delete matching entries and return how many were removed.
+        open_only keeps closed periods; older_than is in seconds.
+        """
+        removed = 0
+        for entry in list(self.entries(issuer)):
+            if open_only and entry["closed"]:
+                continue
+            if older_than is not None and entry["age"] < older_than:
+                continue
+            os.remove(entry["path"])
+            removed += 1
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and evict cached symbolhistory pages.")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="show cached pages")
+    list_parser.add_argument("--issuer")
+    evict_parser = commands.add_parser("evict", help="delete cached pages")
+    evict_parser.add_argument("--issuer")
+    evict_parser.add_argument("--open-only", action="store_true", help="keep pages of closed periods")
+    evict_parser.add_argument("--older-than", type=float, help="only pages older than this many hours")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.root)
+    if args.command == "list":
+        count = size = 0
+        for entry in cache.entries(args.issuer):
+            state = "closed" if entry["closed"] else ("expired" if entry["expired"] else "open")
+            print(f"{entry['issuer']:>6} {entry['from']} - {entry['to']} page {entry['page']:<3} "
+                  f"{entry['size'] / 1024:7.1f} KB {entry['age'] / 3600:8.1f} h  {state}")
+            count += 1
+            size += entry["size"]
+        print(f"{count} pages, {size / (1024 * 1024):.1f} MB")
+    elif args.command == "evict":
+        older_than = args.older_than * 3600 if args.older_than is not None else None
+        print(f"Evicted {cache.evict(args.issuer, args.open_only, older_than)} pages")
+
+
+if __name__ == "__main__":
+    main()
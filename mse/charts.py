@@ -0,0 +1,133 @@
+"""
+Downsampled price series for the trend charts.
+
+A chart cannot show more points than it has pixels across, so each series is reduced to
+about `width` points before it is drawn. lttb() (Largest-Triangle-Three-Buckets) keeps the
+points that preserve the visual shape of the line; minmax() keeps the lowest and highest
+point of every bucket and is fully vectorized. decimate() combines them the way MinMaxLTTB
+does: very long series are first cut down with minmax() to a few times the target, then
+LTTB picks the final points.
+
+TrendCache reads the typed date / price columns straight from the history store's cached
+columns and keeps the decimated series per (issuer, field, date range, width), so redrawing a
+20-issuer comparison only touches the issuers whose data changed.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from mse.storage import to_day
+
+MINMAX_RATIO = 4
+MAX_ENTRIES = 1024
+
+
+def minmax(x, y, n_out):
+    """
+    Indices of the minimum and maximum of y in each of n_out // 2 equal-count buckets.
+    """
+    n = len(y)
+    buckets = max(1, n_out // 2)
+    if n <= n_out:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(np.intp)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    # Within every bucket the points are ordered by value: first is the minimum, last the maximum
+    order = np.lexsort((y, bucket))
+    return np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1]]))
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of the n_out points chosen by Largest-Triangle-Three-Buckets. The first and last
+    points are always kept; x must be increasing.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets over the inner points, each with at least one point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    y_sums = np.concatenate([[0.0], np.cumsum(y)])
+    counts = np.diff(edges)
+    # The third corner of a bucket's triangles is the average of the next bucket; the last
+    # bucket uses the final point
+    next_x = np.append((x_sums[edges[2:]] - x_sums[edges[1:-1]]) / counts[1:], x[-1]).tolist()
+    next_y = np.append((y_sums[edges[2:]] - y_sums[edges[1:-1]]) / counts[1:], y[-1]).tolist()
+
+    xs, ys, bounds = x.tolist(), y.tolist(), edges.tolist()
+    selected = [0]
+    ax, ay = xs[0], ys[0]
+    for i in range(n_out - 2):
+        cx, cy = next_x[i], next_y[i]
+        best, best_area = bounds[i], -1.0
+        for j in range(bounds[i], bounds[i + 1]):
+            area = abs((ax - cx) * (ys[j] - ay) - (ax - xs[j]) * (cy - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        ax, ay = xs[best], ys[best]
+    selected.append(n - 1)
+    return np.array(selected, dtype=np.intp)
+
+
+def decimate(x, y, n_out, ratio=MINMAX_RATIO):
+    """
+    Indices of about n_out points of (x, y) to draw: MinMax preselection, then LTTB.
+    """
+    if len(y) <= n_out:
+        return np.arange(len(y))
+    if len(y) > ratio * n_out:
+        keep = minmax(x, y, ratio * n_out)
+        return keep[lttb(x[keep], y[keep], n_out)]
+    return lttb(x, y, n_out)
+
+
+class TrendCache:
+    def __init__(self, store, max_entries=MAX_ENTRIES):
+        self.store = store
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        # (issuer, field, start, end, width) -> (signature, dates, values)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def series(self, issuer, start=None, end=None, width=1000, field="last"):
+        """
+        (dates, values) of one issuer within [start, end], without missing values and
+        decimated to about `width` points. The arrays are shared and must not be modified.
+        """
+        key = (issuer, field, None if start is None else to_day(start), None if end is None else to_day(end), width)
+        meta = self.store.meta(issuer)
+        signature = (meta["rows"], meta["checksums"].get("date"), meta["checksums"].get(field))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        columns = self.store.range(issuer, start, end, ["date", field])
+        valid = ~np.isnan(columns[field])
+        dates, values = columns["date"][valid], columns[field][valid]
+        keep = decimate(dates.view("i8").astype("f8"), values, width)
+        # Fancy indexing copies the points out of the store's shared columns
+        dates, values = dates[keep], values[keep]
+        with self._lock:
+            self._entries[key] = (signature, dates, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dates, values
+
+    def many(self, issuers, start=None, end=None, width=1000, field="last"):
+        """
+        {issuer: (dates, values)} for a set of issuers, see series().
+        """
+        return {issuer: self.series(issuer, start, end, width, field) for issuer in issuers}
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,83 @@
+"""
+Shared HTTP client for talking to mse.mk and to the Домашна_4 services.
+
+One pooled, keep-alive requests.Session is meant to be created per process and shared by
+all worker threads, instead of a fresh Session (and TCP + TLS handshake) per issuer-year.
+Every call gets a timeout, and 5xx answers and connection resets are retried with
+exponential backoff plus jitter. Each retry is counted in mse.metrics.
+"""
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mse import metrics
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRIES = 4
+BACKOFF = 0.5
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+
+def backoff_delay(attempt, backoff=BACKOFF):
+    """
+    Seconds to wait before retry number `attempt` (1-based): exponential, with full jitter.
+    """
+    return random.uniform(0, backoff * (2 ** (attempt - 1)))
+
+
+class TimeoutSession(requests.Session):
+    """
+    requests.Session that applies a default timeout to every call that does not set one.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class CountingRetry(Retry):
+    """
+    Retry that records every failed attempt it is asked about, by URL path and reason.
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        reason = response.status if response is not None else type(error).__name__
+        metrics.RETRIES.inc(path=(url or "").split("?")[0], reason=reason)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _retry(retries, backoff):
+    options = dict(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        # The symbolhistory POSTs are read-only queries, so they are safe to repeat
+        allowed_methods=frozenset(["GET", "POST"]),
+        backoff_factor=backoff,
+        raise_on_status=False,
+    )
+    try:
+        return CountingRetry(backoff_jitter=backoff, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter option
+        return CountingRetry(**options)
+
+
+def create_session(pool_size=16, retries=RETRIES, backoff=BACKOFF, timeout=DEFAULT_TIMEOUT):
+    """
+    Create a keep-alive session whose connection pool holds `pool_size` connections per host.
+    Size it to the number of threads that share it.
+    """
+    session = TimeoutSession(timeout)
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=_retry(retries, backoff))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
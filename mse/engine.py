@@ -0,0 +1,208 @@
+"""
+asyncio scraping engine for the symbolhistory pages of mse.mk.
+
+Every (issuer, year) job runs on one event loop. A global semaphore caps the number of
+requests in flight across all jobs, and the aiohttp connector caps connections per host,
+so throughput is bound by the budget rather than by a fixed thread count.
+
+    python -m mse.engine --max-in-flight 32 --per-host 8
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+import pandas as pd
+
+from mse import metrics
+from mse.cache import ResponseCache
+from mse.client import HEADERS, RETRIES, RETRY_STATUSES, backoff_delay
+from mse.manifest import plan_updates
+from mse.panel import Panel
+from mse.pagination import PageError, parse_page
+from mse.parsing import next_href, parse_issuers
+from mse.storage import HistoryStore
+
+BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{}"
+
+
+class EngineStats:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.cached = 0
+        self.rows = 0
+        self.issuers = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def summary(self):
+        elapsed = self.elapsed
+        return (f"{self.issuers} issuers, {self.requests} requests ({self.retries} retried, {self.failures} failed), "
+                f"{self.cached} pages from cache, "
+                f"{self.rows} rows in {elapsed:.1f} s: {self.requests / elapsed:.1f} requests/sec, {self.rows / elapsed:.0f} rows/sec")
+
+
+class ScrapeEngine:
+    def __init__(self, store=None, base_url=BASE_URL, max_in_flight=32, per_host=8, timeout=30,
+                 retries=RETRIES, cache=None, log=print):
+        self.store = store or HistoryStore()
+        self.base_url = base_url
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.log = log
+        self.stats = EngineStats()
+
+    async def request(self, session, method, url, stage="fetch", issuer="", year="", **kwargs):
+        """
+        Perform one request inside the global in-flight budget and return the body,
+        or None when the exchange answers with an error status. 5xx answers, connection
+        resets and timeouts are retried with jittered backoff, outside the budget. The time
+        until the final answer is recorded in mse.metrics under `stage`, `issuer` and `year`.
+        """
+        start = time.perf_counter()
+        for attempt in range(1, self.retries + 2):
+            try:
+                async with self._budget:
+                    self.stats.requests += 1
+                    async with session.request(method, url, **kwargs) as response:
+                        status = reason = response.status
+                        if status == 200:
+                            content = await response.read()
+                            metrics.observe(stage, time.perf_counter() - start, issuer, year)
+                            return content
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                status = repr(e)
+                reason = type(e).__name__
+            if attempt > self.retries or (isinstance(status, int) and status not in RETRY_STATUSES):
+                break
+            self.stats.retries += 1
+            metrics.RETRIES.inc(path=url.split("?")[0], reason=reason)
+            await asyncio.sleep(backoff_delay(attempt))
+        self.stats.failures += 1
+        metrics.observe(stage, time.perf_counter() - start, issuer, year)
+        metrics.FAILURES.inc(stage=stage, issuer=issuer, year=year)
+        self.log(f"Failed to retrieve {url}. Status: {status}")
+        return None
+
+    async def fetch_issuer_list(self, session):
+        content = await self.request(session, "GET", self.base_url.format("ADIN"), stage="issuer_list")
+        return parse_issuers(content) if content else []
+
+    async def fetch_page(self, session, url, payload, page):
+        """
+        Return one result page, from the response cache when possible.
+        """
+        issuer, year = metrics.payload_labels(payload)
+        if self.cache is not None:
+            content = self.cache.get_payload(payload, page)
+            if content is not None:
+                self.stats.cached += 1
+                metrics.PAGES.inc(issuer=issuer, year=year, source="cache")
+                return content
+        content = await self.request(session, "POST", url, issuer=issuer, year=year, data=payload)
+        if content is not None:
+            metrics.PAGES.inc(issuer=issuer, year=year, source="network")
+        if content is not None and self.cache is not None:
+            self.cache.put_payload(payload, page, content)
+        return content
+
+    async def iter_pages(self, session, url, payload):
+        """
+        Async iterator over the typed records of each result page. The next page is
+        requested as soon as its link is found, while the current page is still being parsed.
+        Raises PageError when a page fails, so a partial year is never stored.
+        """
+        loop = asyncio.get_running_loop()
+        page = 1
+        pending = asyncio.ensure_future(self.fetch_page(session, url, payload, page))
+        try:
+            while pending is not None:
+                content = await pending
+                if content is None:
+                    raise PageError(f"Failed to retrieve page {page} of {payload['Code']} {payload['FromDate'][-4:]}")
+                href = next_href(content)
+                if href:
+                    url = urljoin(url, href)
+                    page += 1
+                    pending = asyncio.ensure_future(self.fetch_page(session, url, payload, page))
+                else:
+                    pending = None
+                # Parsing is CPU work; keep it off the event loop so other responses keep flowing
+                yield await loop.run_in_executor(None, parse_page, content, *metrics.payload_labels(payload))
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def gather_annual_data(self, session, issuer_code, year):
+        payload = {
+            'Code': issuer_code,
+            'FromDate': f"01.01.{year}",
+            'ToDate': f"31.12.{year}"
+        }
+        records = []
+        async for page_records in self.iter_pages(session, self.base_url.format(issuer_code), payload):
+            records.extend(page_records)
+        return records[::-1]
+
+    async def update_issuer(self, session, issuer_code, years):
+        try:
+            results = await asyncio.gather(*(self.gather_annual_data(session, issuer_code, year) for year in years))
+            records = [record for year_records in results for record in year_records]
+            if not records:
+                return
+            loop = asyncio.get_running_loop()
+            added = await loop.run_in_executor(None, self.store.append, issuer_code, pd.DataFrame(records))
+            self.stats.rows += added
+            self.stats.issuers += 1
+            self.log(f"Data for {issuer_code} saved successfully ({added} new rows).")
+        except Exception as e:
+            self.stats.failures += 1
+            self.log(f"Failed to update data for {issuer_code}: {e}")
+
+    async def run(self, issuer_codes=None, today=None):
+        self.stats = EngineStats()
+        self._budget = asyncio.Semaphore(self.max_in_flight)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+            if issuer_codes is None:
+                issuer_codes = await self.fetch_issuer_list(session)
+            plan = plan_updates(self.store.manifest, issuer_codes, today)
+            self.log(f"{len(issuer_codes) - len(plan)} issuers are up to date, updating {len(plan)}.")
+            await asyncio.gather(*(self.update_issuer(session, issuer, years) for issuer, (_, years) in plan.items()))
+        self.log(self.stats.summary())
+        return self.stats
+
+
+def run(issuer_codes=None, **kwargs):
+    """
+    Synchronous entry point with the same effect as the threaded main() of the scrapers.
+    """
+    return asyncio.run(ScrapeEngine(**kwargs).run(issuer_codes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape issuer history from mse.mk with asyncio.")
+    parser.add_argument("--root", default=None, help="history store location (default: the shared data/history)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--max-in-flight", type=int, default=32, help="global limit of concurrent requests")
+    parser.add_argument("--per-host", type=int, default=8, help="concurrent connections per host")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the response cache")
+    args = parser.parse_args()
+    store = HistoryStore(args.root) if args.root else None
+    cache = None if args.no_cache else ResponseCache()
+    run(store=store, base_url=args.base_url, max_in_flight=args.max_in_flight, per_host=args.per_host, cache=cache)
+    print(f"Panel updated with {Panel(store or HistoryStore()).update()} new trading days.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Encoders for slices of stored history, used by the /history endpoint of Домашна_4.
+
+Every encoder takes {file key: array} as returned by HistoryStore.range and returns bytes.
+Dates are written as ISO text (yyyy-mm-dd) and missing prices as null / empty fields.
+Arrow IPC needs pyarrow and is only offered when it is installed.
+"""
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+JSON = "application/json"
+CSV = "text/csv"
+ARROW = "application/vnd.apache.arrow.stream"
+
+
+def _json_values(values):
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values, unit="D").tolist()
+    if values.dtype.kind == "f":
+        # NaN is not valid JSON
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+
+def encode_json(columns, **extra):
+    """
+    Columnar JSON: {"columns": {"date": [...], "last": [...]}, **extra}.
+    """
+    payload = dict(extra, columns={key: _json_values(values) for key, values in columns.items()})
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def encode_csv(columns):
+    buffer = io.StringIO()
+    pd.DataFrame(dict(columns)).to_csv(buffer, index=False, date_format="%Y-%m-%d")
+    return buffer.getvalue().encode("utf-8")
+
+
+def encode_arrow(columns):
+    import pyarrow as pa
+
+    table = pa.table({key: np.asarray(values) for key, values in columns.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def available_formats():
+    formats = [JSON, CSV]
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return formats
+    return formats + [ARROW]
+
+
+def encode(columns, mimetype, **extra):
+    """
+    Encode with the encoder for `mimetype`; `extra` fields only go into JSON bodies.
+    """
+    if mimetype == JSON:
+        return encode_json(columns, **extra)
+    if mimetype == CSV:
+        return encode_csv(columns)
+    if mimetype == ARROW:
+        return encode_arrow(columns)
+    raise ValueError(f"Unsupported format {mimetype}")
@@ -0,0 +1,73 @@
+"""
+Cross-process locks for the files of the history store.
+
+The store is written by several processes at once (data_management_service, main1.py and
+Домашна_4/main.py), so a threading.Lock only orders the writers of one process. FileLock
+holds an OS lock on a small lock file next to the data it guards: fcntl.flock on POSIX,
+msvcrt.locking on Windows. Threads of one process first queue on a threading.Lock for the
+same path, so only one of them at a time waits on the file.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+_thread_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # LK_LOCK gives up after about 10 seconds; keep waiting like flock does
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        with _registry_lock:
+            self._thread_lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a+b")
+            _lock_file(self._file)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            _unlock_file(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
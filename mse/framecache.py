@@ -0,0 +1,109 @@
+"""
+In-process LRU cache of parsed issuer frames, bounded by memory.
+
+GUI callbacks and service handlers ask for the same issuer's history over and over;
+FrameCache keeps the typed DataFrames built from the history store and hands the same
+object back while the issuer's data is unchanged. Entries are evicted least recently used
+first once their total size (DataFrame.memory_usage, in bytes) exceeds max_bytes.
+
+An entry is reused while the store manifest version is the one it was loaded under. When
+the version moved on (any issuer was written), the entry is kept only if its own issuer's
+manifest entry and the mtime / size of its column files are unchanged, so updates to other
+issuers do not flush the whole cache.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from mse.storage import to_day
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class FrameCache:
+    def __init__(self, store, max_bytes=DEFAULT_MAX_BYTES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        # (issuer, fields) -> (manifest version, signature, frame, size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _signature(self, issuer, fields):
+        meta = self.store.meta(issuer)
+        files = []
+        for key in fields or ["date"]:
+            try:
+                stat = os.stat(self.store.path(issuer, f"{key}.bin"))
+                files.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                files.append(None)
+        return meta["rows"], meta["last_date"], tuple(sorted(meta["checksums"].items())), tuple(files)
+
+    def get(self, issuer, fields=None):
+        """
+        Return the issuer's history as a DataFrame (see HistoryStore.frame).
+        The frame is shared with other callers and must not be modified in place.
+        """
+        key = (issuer, tuple(fields) if fields else None)
+        version = self.store.manifest.version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] != version:
+                    signature = self._signature(issuer, fields)
+                    if signature == entry[1]:
+                        entry = self._entries[key] = (version,) + entry[1:]
+                    else:
+                        self._drop(key)
+                        self.invalidations += 1
+                        entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+
+        # Build the frame outside the lock so other threads are not held up
+        signature = self._signature(issuer, fields)
+        frame = self.store.frame(issuer, fields)
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (version, signature, frame, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return frame
+
+    def range(self, issuer, start=None, end=None, fields=None):
+        """
+        Rows of the cached frame dated within [start, end], found by binary search.
+        """
+        frame = self.get(issuer, fields)
+        dates = frame["Date"].to_numpy().astype("M8[D]")
+        first = 0 if start is None else np.searchsorted(dates, to_day(start))
+        stop = len(dates) if end is None else np.searchsorted(dates, to_day(end), side="right")
+        return frame.iloc[first:max(first, stop)]
+
+    def invalidate(self, issuer=None):
+        with self._lock:
+            for key in [key for key in self._entries if issuer is None or key[0] == issuer]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry[3]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "invalidations": self.invalidations}
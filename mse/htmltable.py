@@ -0,0 +1,176 @@
+"""
+Pluggable HTML backends for the two things the scrapers read from mse.mk pages:
+the cells of the #resultsTable rows and the options of the #Code issuer <select>.
+
+    bs4         BeautifulSoup with html.parser, the original (slow) reference
+    lxml        lxml.html
+    selectolax  selectolax with the Lexbor engine, usually the fastest
+
+The fastest installed backend is used unless MSE_HTML_PARSER names one. `check` verifies
+that every installed backend reads the same records and issuer options as bs4, and that the
+pager link found by mse.parsing.next_href is bs4's ".next > a", then times the backends. It
+runs on the pages in mse/fixtures/symbolhistory/ unless others are given:
+
+    python -m mse.htmltable check [page1.html page2.html ...]
+"""
+import argparse
+import glob
+import os
+import time
+
+ROWS_SELECTOR = "#resultsTable > tbody > tr"
+OPTIONS_SELECTOR = "#Code > option"
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "symbolhistory")
+
+
+def _bs4_rows(content):
+    from bs4 import BeautifulSoup as BS
+    soup = BS(content, 'html.parser')
+    return [[cell.text.strip() for cell in row.select("td")] for row in soup.select(ROWS_SELECTOR)]
+
+
+def _bs4_options(content):
+    from bs4 import BeautifulSoup as BS
+    soup = BS(content, 'html.parser')
+    return [opt.text.strip() for opt in soup.select(OPTIONS_SELECTOR)]
+
+
+def _bs4_next(content):
+    from bs4 import BeautifulSoup as BS
+    link = BS(content, 'html.parser').select_one(".next > a")
+    return link["href"] if link else None
+
+
+def _lxml_rows(content):
+    import lxml.html
+    doc = lxml.html.fromstring(content)
+    return [[cell.text_content().strip() for cell in row.findall("td")]
+            for row in doc.xpath('//table[@id="resultsTable"]/tbody/tr')]
+
+
+def _lxml_options(content):
+    import lxml.html
+    doc = lxml.html.fromstring(content)
+    return [opt.text_content().strip() for opt in doc.xpath('//*[@id="Code"]/option')]
+
+
+def _selectolax_rows(content):
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(content)
+    return [[cell.text().strip() for cell in row.css("td")] for row in tree.css(ROWS_SELECTOR)]
+
+
+def _selectolax_options(content):
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(content)
+    return [opt.text().strip() for opt in tree.css(OPTIONS_SELECTOR)]
+
+
+BACKENDS = {
+    "bs4": (_bs4_rows, _bs4_options),
+    "lxml": (_lxml_rows, _lxml_options),
+    "selectolax": (_selectolax_rows, _selectolax_options),
+}
+PREFERENCE = ["selectolax", "lxml", "bs4"]
+
+
+def available_backends():
+    names = []
+    for name, module in [("selectolax", "selectolax.lexbor"), ("lxml", "lxml.html"), ("bs4", "bs4")]:
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+_default_backend = None
+
+
+def default_backend():
+    global _default_backend
+    if _default_backend is None:
+        installed = available_backends()
+        requested = os.environ.get("MSE_HTML_PARSER")
+        if requested and requested not in installed:
+            raise ValueError(f"HTML parser backend {requested!r} is not installed (available: {installed})")
+        _default_backend = requested or next(name for name in PREFERENCE if name in installed)
+    return _default_backend
+
+
+def extract_cells(content, backend=None):
+    """
+    Return the stripped cell texts of every #resultsTable body row, one list per row.
+    """
+    return BACKENDS[backend or default_backend()][0](content)
+
+
+def extract_options(content, backend=None):
+    """
+    Return the stripped texts of every option of the #Code select.
+    """
+    return BACKENDS[backend or default_backend()][1](content)
+
+
+def fixture_pages():
+    return sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+
+
+def check(paths=None, repeat=20):
+    """
+    Parse every page with each installed backend, verify the records and issuer options match
+    the bs4 reference exactly and print the average time per page. Returns True when they do.
+    """
+    from mse.parsing import convert_cells, next_href, to_records
+
+    paths = paths or fixture_pages()
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    reference = [(to_records(convert_cells(_bs4_rows(page))), _bs4_options(page)) for page in pages]
+
+    ok = True
+    for path, page, (expected, _) in zip(paths, pages, reference):
+        link = next_href(page)
+        print(f"{os.path.basename(path)}: {len(expected)} rows, next page {link or '-'}")
+        if link != _bs4_next(page):
+            print(f"next_href differs from bs4 on {path}")
+            ok = False
+    for backend in available_backends():
+        for path, page, (expected, options) in zip(paths, pages, reference):
+            records = to_records(convert_cells(extract_cells(page, backend)))
+            if _normalize(records) != _normalize(expected):
+                print(f"{backend}: records differ from bs4 on {path}")
+                ok = False
+            if extract_options(page, backend) != options:
+                print(f"{backend}: issuer options differ from bs4 on {path}")
+                ok = False
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                extract_cells(page, backend)
+        per_page = (time.perf_counter() - start_time) / (repeat * len(pages)) * 1000
+        print(f"{backend:>10}: {per_page:.2f} ms per page")
+    return ok
+
+
+def _normalize(records):
+    # NaN != NaN, so compare blank cells through their repr
+    return [{key: repr(value) for key, value in record.items()} for record in records]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the HTML parser backends.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check_parser = commands.add_parser("check", help="compare backends on saved symbolhistory pages")
+    check_parser.add_argument("pages", nargs="*", help="default: the pages in mse/fixtures/symbolhistory/")
+    check_parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    if not check(args.pages, args.repeat):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Vectorized technical indicators over a dates x issuers matrix.
+
+Every function takes 2-D float arrays with one row per trading day and one column per
+issuer (1-D arrays are treated as a single issuer) and works along the time axis for
+all issuers at once. NaN marks days before an issuer's first or after its last quote;
+indicators stay NaN until enough valid rows are available. Signals are built with
+np.select instead of row-by-row Python loops.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+BUY, HOLD, SELL = "Buy", "Hold", "Sell"
+# Default windows: MACD fast / slow / signal EMAs, SMA / EMA / Bollinger window, stochastic %K / %D
+FAST, SLOW, SIGNAL = 12, 26, 9
+WINDOW, BOLLINGER_K = 20, 2.0
+STOCH_K, STOCH_D = 14, 3
+
+
+def _2d(x):
+    x = np.asarray(x, dtype="f8")
+    return x[:, None] if x.ndim == 1 else x
+
+
+def _like(result, x):
+    return result[:, 0] if np.ndim(x) == 1 else result
+
+
+def ffill(x):
+    """
+    Forward-fill NaN gaps along the time axis; leading NaN stay NaN.
+    """
+    values = _2d(x)
+    rows = np.arange(len(values))[:, None]
+    index = np.where(np.isnan(values), 0, rows)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return _like(np.take_along_axis(values, index, axis=0), x)
+
+
+def diff(x):
+    values = _2d(x)
+    out = np.full_like(values, np.nan)
+    out[1:] = values[1:] - values[:-1]
+    return _like(out, x)
+
+
+def window_sum(values, n):
+    """
+    Sums over every window of n consecutive rows of a 2-D array (len(values) - n + 1 rows).
+    The streaming state sums its window tails the same way, so both paths agree bit for bit.
+    """
+    return sliding_window_view(values, n, axis=0).sum(axis=-1)
+
+
+def rolling_sum(x, n):
+    """
+    Sum of the last n rows; NaN unless all n of them are valid.
+    """
+    values = _2d(x)
+    out = np.full_like(values, np.nan)
+    if len(values) >= n:
+        out[n - 1:] = window_sum(values, n)
+    return _like(out, x)
+
+
+def sma(x, n):
+    return rolling_sum(x, n) / n
+
+
+def rolling_std(x, n):
+    """
+    Population standard deviation over the last n rows.
+    """
+    mean = sma(x, n)
+    mean_sq = sma(np.square(_like(_2d(x), x)), n)
+    return np.sqrt(np.maximum(mean_sq - np.square(mean), 0.0))
+
+
+def _rolling_extreme(x, n, reduce):
+    values = _2d(x)
+    out = np.full_like(values, np.nan)
+    if len(values) >= n:
+        out[n - 1:] = reduce(sliding_window_view(values, n, axis=0), axis=-1)
+    return _like(out, x)
+
+
+def rolling_max(x, n):
+    return _rolling_extreme(x, n, np.max)
+
+
+def rolling_min(x, n):
+    return _rolling_extreme(x, n, np.min)
+
+
+def ewm(x, alpha, n):
+    """
+    Exponentially weighted mean seeded with the simple mean of the first n valid rows:
+    EMA with alpha = 2 / (n + 1), Wilder smoothing with alpha = 1 / n.
+    The recursion runs over time with vector operations across all issuers.
+    """
+    values = _2d(x)
+    if len(values) == 0:
+        return _like(values.copy(), x)
+    seeds = sma(values, n)
+    seeded = ~np.isnan(seeds)
+    start = np.where(seeded.any(axis=0), seeded.argmax(axis=0), len(values))
+    starts = {t: np.flatnonzero(start == t) for t in np.unique(start[start < len(values)])}
+    valid = ~np.isnan(values)
+    out = np.full_like(values, np.nan)
+    state = np.zeros(values.shape[1])
+    step = np.empty_like(state)
+    for t in range(min(starts, default=len(values)), len(values)):
+        np.subtract(values[t], state, out=step)
+        step *= alpha
+        np.add(state, step, out=state, where=valid[t])
+        if t in starts:
+            state[starts[t]] = seeds[t, starts[t]]
+        out[t] = state
+    out[(np.arange(len(values))[:, None] < start) | ~valid] = np.nan
+    return _like(out, x)
+
+
+def ema(x, n):
+    return ewm(x, 2.0 / (n + 1), n)
+
+
+def wilder(x, n):
+    return ewm(x, 1.0 / n, n)
+
+
+def rsi_from_averages(avg_gain, avg_loss):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    rsi = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), rsi)
+    return np.where(np.isnan(avg_gain) | np.isnan(avg_loss), np.nan, rsi)
+
+
+def rsi_averages(close, n=14, method="wilder"):
+    """
+    Average gain and average loss behind the RSI, smoothed with Wilder's method or a simple mean.
+    """
+    delta = diff(close)
+    gain = np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0))
+    loss = np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0))
+    smooth = wilder if method == "wilder" else sma
+    return smooth(gain, n), smooth(loss, n)
+
+
+def rsi(close, n=14, method="wilder"):
+    """
+    Relative Strength Index with Wilder smoothing (method="wilder") or simple moving averages ("sma").
+    """
+    return rsi_from_averages(*rsi_averages(close, n, method))
+
+
+def macd(close, fast=FAST, slow=SLOW, signal=SIGNAL):
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, n=WINDOW, k=BOLLINGER_K):
+    mid = sma(close, n)
+    std = rolling_std(close, n)
+    return mid, mid + k * std, mid - k * std
+
+
+def stochastic(close, high=None, low=None, k=STOCH_K, d=STOCH_D):
+    """
+    Stochastic oscillator %K and %D. Blank Max/Min cells (days without trades) fall back to the close.
+    """
+    high = close if high is None else np.where(np.isnan(high), close, high)
+    low = close if low is None else np.where(np.isnan(low), close, low)
+    highest = rolling_max(high, k)
+    lowest = rolling_min(low, k)
+    price_range = highest - lowest
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent_k = np.where(price_range == 0, 50.0, 100.0 * (close - lowest) / price_range)
+    percent_k = np.where(np.isnan(price_range), np.nan, percent_k)
+    return percent_k, sma(percent_k, d)
+
+
+def obv(close, volume):
+    """
+    On-balance volume: running total of volume signed by the direction of the close.
+    """
+    step = np.sign(diff(close)) * volume
+    total = np.cumsum(np.nan_to_num(step), axis=0)
+    return np.where(np.isnan(close), np.nan, total)
+
+
+def volume_ratio(volume, n=WINDOW):
+    """
+    Volume relative to its n-day average; above 1 means unusually heavy trading.
+    """
+    average = sma(volume, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(average > 0, volume / average, np.nan)
+
+
+# --- Signals ---
+def rsi_signals(rsi_values, low=30, high=70):
+    return np.select([rsi_values < low, rsi_values > high], [BUY, SELL], HOLD)
+
+
+def macd_signals(histogram):
+    previous = np.full_like(histogram, np.nan)
+    previous[1:] = histogram[:-1]
+    return np.select([(previous <= 0) & (histogram > 0), (previous >= 0) & (histogram < 0)], [BUY, SELL], HOLD)
+
+
+def bollinger_signals(close, upper, lower):
+    return np.select([close < lower, close > upper], [BUY, SELL], HOLD)
+
+
+def stochastic_signals(percent_k, percent_d, low=20, high=80):
+    return np.select([(percent_k < low) & (percent_k > percent_d), (percent_k > high) & (percent_k < percent_d)],
+                     [BUY, SELL], HOLD)
+
+
+def combined_signals(*signals, votes=2):
+    """
+    Buy or Sell when at least `votes` of the individual signals agree, Hold otherwise.
+    """
+    score = sum((s == BUY).astype(int) - (s == SELL).astype(int) for s in signals)
+    return np.select([score >= votes, score <= -votes], [BUY, SELL], HOLD)
+
+
+# --- Market-wide analysis ---
+def market_matrix(market, keys=("last",), dates=None):
+    """
+    Align {issuer: columns} from HistoryStore.load_market into (dates, issuers, {key: matrix}):
+    the union of all trading days x issuers, NaN where an issuer has no row.
+    Pass `dates` (sorted) to use a given calendar instead; rows on other days are left out.
+    """
+    issuers = sorted(market)
+    if dates is None:
+        if not issuers:
+            return np.empty(0, dtype="M8[D]"), [], {key: np.empty((0, 0)) for key in keys}
+        dates = np.unique(np.concatenate([market[issuer]["date"] for issuer in issuers]))
+    matrices = {key: np.full((len(dates), len(issuers)), np.nan) for key in keys}
+    for column, issuer in enumerate(issuers):
+        issuer_dates = np.asarray(market[issuer]["date"])
+        rows = np.searchsorted(dates, issuer_dates)
+        keep = rows < len(dates)
+        keep[keep] = dates[rows[keep]] == issuer_dates[keep]
+        for key in keys:
+            matrices[key][rows[keep], column] = np.asarray(market[issuer][key])[keep]
+    return dates, issuers, matrices
+
+
+def analyze(close, high=None, low=None, volume=None, period=14):
+    """
+    Compute every indicator and signal for a dates x issuers close matrix.
+    Returns {column name: matrix}.
+    """
+    close = ffill(close)
+    fast, slow = ema(close, FAST), ema(close, SLOW)
+    line = fast - slow
+    signal_line = ema(line, SIGNAL)
+    histogram = line - signal_line
+    avg_gain, avg_loss = rsi_averages(close, period)
+    mid, upper, lower = bollinger(close)
+    percent_k, percent_d = stochastic(close, high, low)
+    results = {
+        f"RSI_{period}": rsi_from_averages(avg_gain, avg_loss),
+        f"RSI_SMA_{period}": rsi(close, period, method="sma"),
+        f"Avg_Gain_{period}": avg_gain,
+        f"Avg_Loss_{period}": avg_loss,
+        f"SMA_{WINDOW}": sma(close, WINDOW),
+        f"EMA_{FAST}": fast,
+        f"EMA_{WINDOW}": ema(close, WINDOW),
+        f"EMA_{SLOW}": slow,
+        "MACD": line,
+        "MACD_Signal": signal_line,
+        "MACD_Hist": histogram,
+        "BB_Mid": mid,
+        "BB_Upper": upper,
+        "BB_Lower": lower,
+        "Stoch_K": percent_k,
+        "Stoch_D": percent_d,
+    }
+    signals = [
+        rsi_signals(results[f"RSI_{period}"]),
+        macd_signals(histogram),
+        bollinger_signals(close, upper, lower),
+        stochastic_signals(percent_k, percent_d),
+    ]
+    if volume is not None:
+        results["OBV"] = obv(close, volume)
+        results["Volume_Ratio"] = volume_ratio(volume)
+    results[f"Signal_{period}"] = signals[0]
+    results["Signal"] = combined_signals(*signals)
+    return results
+
+
+def analyze_market(store, issuers=None, period=14):
+    """
+    Run analyze() over every issuer in the store at once.
+    Returns (dates, issuers, {column name: dates x issuers matrix}).
+    """
+    market = store.load_market(["date", "last", "max", "min", "quantity"])
+    if issuers is not None:
+        wanted = set(issuers)
+        market = {issuer: columns for issuer, columns in market.items() if issuer in wanted}
+    dates, codes, m = market_matrix(market, ["last", "max", "min", "quantity"])
+    return dates, codes, analyze(m["last"], m["max"], m["min"], m["quantity"], period)
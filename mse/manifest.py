@@ -0,0 +1,133 @@
+"""
+Store-wide manifest of per-issuer watermarks.
+
+manifest.json sits at the root of the history store and records, for every issuer, the
+committed row count, the last trading date and a CRC32 per column file. Every writer
+updates it as its commit step, so update planning never has to open a data file. Several
+processes write to one store, so the read-modify-write holds the manifest.lock file lock:
+
+    {"version": 42,
+     "issuers": {"ALK": {"rows": 2664, "last_date": "2024-11-08", "checksums": {"date": ..., ...}}}}
+"""
+import json
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+
+from mse.filelock import FileLock
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        TIMEZONE = ZoneInfo("Europe/Skopje")
+    except ZoneInfoNotFoundError:
+        TIMEZONE = None  # no tz database (Windows without tzdata): use local time
+except ImportError:
+    TIMEZONE = None
+
+FIRST_DATE = date(2014, 11, 3)
+# Trading ends at 13:00 Skopje time; the history pages are complete a while later
+RUN_AFTER = time(14, 0)
+
+
+class Manifest:
+    def __init__(self, root):
+        self.path = os.path.join(root, "manifest.json")
+        self._lock = FileLock(os.path.join(root, "manifest.lock"))
+        self._cached = (None, None)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0, "issuers": {}}
+
+    def load(self):
+        """
+        Return the manifest, re-reading the file only when its stat signature changed.
+        The returned dict is shared between callers and must not be modified.
+        """
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+        except FileNotFoundError:
+            signature = None
+        cached_signature, manifest = self._cached
+        if manifest is None or signature != cached_signature:
+            manifest = self._read()
+            self._cached = (signature, manifest)
+        return manifest
+
+    def version(self):
+        return self.load()["version"]
+
+    def entries(self):
+        return self.load()["issuers"]
+
+    def entry(self, issuer):
+        return self.entries().get(issuer, {"rows": 0, "last_date": None, "checksums": {}})
+
+    def update(self, issuer, entry):
+        """
+        Record a new committed state for an issuer. The file is rewritten through a temp
+        file and rename, so readers always see either the old or the new manifest.
+        """
+        with self._lock:
+            manifest = self._read()
+            manifest["version"] += 1
+            manifest["issuers"][issuer] = entry
+            fd, tmp_path = tempfile.mkstemp(prefix="manifest.", suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, sort_keys=True)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            stat = os.stat(self.path)
+            self._cached = ((stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns), manifest)
+            return manifest["version"]
+
+
+def last_trading_day(now=None):
+    """
+    The most recent weekday whose session is over at `now` (default: the current Skopje time);
+    the exchange has no weekend sessions. Today counts from RUN_AFTER on. A plain date is taken
+    as the start of that day, so its own session is not over yet.
+    """
+    now = now or datetime.now(TIMEZONE)
+    if isinstance(now, datetime):
+        if now.weekday() < 5 and now.time() >= RUN_AFTER:
+            return now.date()
+        now = now.date()
+    day = now - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def plan_updates(manifest, issuers, today=None):
+    """
+    Decide what to fetch for every issuer using only the manifest.
+    Returns {issuer: (start_date, years)} for issuers that are behind; issuers whose
+    watermark already covers the last trading day are left out. `today` is a date or a
+    datetime, see last_trading_day(); by default it is the current time.
+    """
+    today = today or datetime.now(TIMEZONE)
+    up_to = last_trading_day(today)
+    entries = manifest.entries()
+    plan = {}
+    for issuer in issuers:
+        last_date = (entries.get(issuer) or {}).get("last_date")
+        if last_date is None:
+            start_date = FIRST_DATE
+        else:
+            last_date = datetime.strptime(last_date, "%Y-%m-%d").date()
+            if last_date >= up_to:
+                continue
+            start_date = last_date + timedelta(days=1)
+        plan[issuer] = (start_date, list(range(start_date.year, today.year + 1)))
+    return plan
@@ -0,0 +1,272 @@
+"""
+Stage timings and counters for the scrapers and the Домашна_4 services.
+
+Every unit of work is timed under a stage name: issuer_list (the issuer <select> page),
+fetch (one result page over HTTP, retries and backoff included), parse (one page into
+records) and write (one HistoryStore append). The timings go into the mse_stage_seconds
+histogram, labelled by stage only so the number of series stays small, and into the
+mse_issuer_stage_seconds_total counter, labelled by stage, issuer and year, which tells
+which issuer-years a slow run spent its time on. Pages, rows, retries and failures are
+counted next to them.
+
+The Flask services expose the registry at /metrics in the Prometheus text format
+(instrument_app); the batch scripts print summary() at the end of a run.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_seconds(seconds):
+    return f"{seconds * 1000:.1f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        {label values: value}, a copy that is safe to read while other threads keep counting.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def total(self, **labels):
+        """
+        Sum over every series whose labels match the given ones.
+        """
+        wanted = [(self.labels.index(name), str(value)) for name, value in labels.items()]
+        return sum(value for key, value in self.samples().items() if all(key[i] == v for i, v in wanted))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+                for key, value in sorted(self.samples().items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [counts per bucket (the last one is +Inf), sum, count, max]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+            series[3] = max(series[3], value)
+
+    def samples(self):
+        with self._lock:
+            return {key: [list(series[0])] + series[1:] for key, series in self._series.items()}
+
+    def quantile(self, counts, q):
+        """
+        Upper bound of the bucket holding the q-quantile of the given bucket counts.
+        """
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count, _) in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                labels = _format_labels(self.labels, key, [("le", _format_number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def render(self):
+        """
+        The whole registry in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("mse_stage_seconds", "Wall time of one unit of work", ["stage"])
+ISSUER_SECONDS = REGISTRY.counter("mse_issuer_stage_seconds_total", "Wall time spent per stage, issuer and year",
+                                  ["stage", "issuer", "year"])
+PAGES = REGISTRY.counter("mse_pages_total", "Result pages read, from the network or the response cache",
+                         ["issuer", "year", "source"])
+ROWS = REGISTRY.counter("mse_rows_total", "Rows parsed from pages and rows written to the store",
+                        ["stage", "issuer", "year"])
+RETRIES = REGISTRY.counter("mse_retries_total", "HTTP attempts that were retried", ["path", "reason"])
+FAILURES = REGISTRY.counter("mse_failures_total", "Units of work that failed", ["stage", "issuer", "year"])
+HTTP_SECONDS = REGISTRY.histogram("mse_http_request_seconds", "Time to answer one request to a service",
+                                  ["service", "endpoint", "status"])
+
+
+def payload_labels(payload):
+    """
+    (issuer, year) of a symbolhistory query payload.
+    """
+    return payload.get("Code", ""), str(payload.get("FromDate", ""))[-4:]
+
+
+def observe(stage, seconds, issuer="", year=""):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if issuer:
+        ISSUER_SECONDS.inc(seconds, stage=stage, issuer=issuer, year=year)
+
+
+@contextmanager
+def timed(stage, issuer="", year=""):
+    """
+    Time the block under `stage`; an exception leaving the block is counted as a failure.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        FAILURES.inc(stage=stage, issuer=issuer, year=year)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, issuer, year)
+
+
+def reset():
+    REGISTRY.reset()
+
+
+def summary(registry=REGISTRY, top=5):
+    """
+    End-of-run report: per-stage timings, counter totals and the slowest issuer-years.
+    """
+    lines = ["Stage timings:"]
+    for key, (counts, total, count, longest) in sorted(STAGE_SECONDS.samples().items()):
+        lines.append(f"  {key[0]:<12} {count:>7} x  total {_format_seconds(total):>10}  "
+                     f"mean {_format_seconds(total / count):>10}  p95 <= {_format_seconds(STAGE_SECONDS.quantile(counts, 0.95))}"
+                     f"  max {_format_seconds(longest)}")
+    lines.append(f"Pages: {PAGES.total(source='network')} fetched, {PAGES.total(source='cache')} from cache; "
+                 f"rows: {ROWS.total(stage='parse')} parsed, {ROWS.total(stage='write')} written; "
+                 f"retries: {RETRIES.total()}; failures: {FAILURES.total()}")
+
+    per_issuer_year = {}
+    for (stage, issuer, year), seconds in ISSUER_SECONDS.samples().items():
+        per_issuer_year.setdefault((issuer, year), {})[stage] = seconds
+    slowest = sorted(per_issuer_year.items(), key=lambda item: -sum(item[1].values()))[:top]
+    if slowest:
+        lines.append("Slowest issuer-years:")
+        for (issuer, year), stages in slowest:
+            parts = ", ".join(f"{stage} {_format_seconds(seconds)}" for stage, seconds in sorted(stages.items()))
+            lines.append(f"  {issuer} {year or '-'}: {parts}")
+    return "\n".join(lines)
+
+
+def instrument_app(app, service, registry=REGISTRY):
+    """
+    Time every request of a Flask app and serve the registry at GET /metrics.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None and request.endpoint != "metrics":
+            HTTP_SECONDS.observe(time.perf_counter() - start, service=service,
+                                 endpoint=request.endpoint or "unknown", status=response.status_code)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return app.response_class(registry.render(), content_type=CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,78 @@
+"""
+Iterative, pipelined pagination over symbolhistory result pages.
+
+Pages are followed through the ".next > a" link in a loop instead of by recursion. As soon
+as a page arrives its next link is located and that request is started in the background,
+then the current page is parsed and its rows are yielded, so network time overlaps parsing
+and only one page is held in memory at a time.
+
+When a ResponseCache is given, pages are served from it where possible and every fetched
+page is stored in it. Fetch and parse times, pages and rows are recorded in mse.metrics.
+
+A page that cannot be retrieved raises PageError instead of ending the iteration: pages come
+newest first, so storing the rows read so far would move the watermark past the missing ones.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from mse import metrics
+from mse.parsing import next_href, parse_records
+
+
+class PageError(RuntimeError):
+    """
+    A result page could not be retrieved, so the rows of the query are incomplete.
+    """
+
+
+def fetch_page(session, url, payload, page, cache=None):
+    """
+    Return the body of one result page, or (None, status code) when the request fails.
+    """
+    issuer, year = metrics.payload_labels(payload)
+    if cache is not None:
+        content = cache.get_payload(payload, page)
+        if content is not None:
+            metrics.PAGES.inc(issuer=issuer, year=year, source="cache")
+            return content, 200
+    with metrics.timed("fetch", issuer, year):
+        response = session.post(url, data=payload)
+    if response.status_code != 200:
+        metrics.FAILURES.inc(stage="fetch", issuer=issuer, year=year)
+        return None, response.status_code
+    metrics.PAGES.inc(issuer=issuer, year=year, source="network")
+    if cache is not None:
+        cache.put_payload(payload, page, response.content)
+    return response.content, 200
+
+
+def parse_page(content, issuer="", year=""):
+    """
+    parse_records() for one page, timed and counted under the page's issuer and year.
+    """
+    with metrics.timed("parse", issuer, year):
+        records = parse_records(content)
+    metrics.ROWS.inc(len(records), stage="parse", issuer=issuer, year=year)
+    return records
+
+
+def iter_page_records(session, url, payload, cache=None):
+    """
+    Yield typed records from every page of a POSTed symbolhistory query, in page order.
+    Raises PageError when a page fails; the caller must not store what it has read so far.
+    """
+    page = 1
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(fetch_page, session, url, payload, page, cache)
+        while pending is not None:
+            content, status_code = pending.result()
+            if content is None:
+                raise PageError(f"Failed to retrieve data. Status code: {status_code}")
+            href = next_href(content)
+            if href:
+                url = urljoin(url, href)
+                page += 1
+                pending = prefetch.submit(fetch_page, session, url, payload, page, cache)
+            else:
+                pending = None
+            yield from parse_page(content, *metrics.payload_labels(payload))
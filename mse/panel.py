@@ -0,0 +1,328 @@
+"""
+Aligned trading-day x issuer panel for cross-sectional queries.
+
+The history store keeps one column file per issuer; questions that span the market
+(correlations, a market index, who moved most today) need every issuer on the same
+calendar. The panel stores that alignment once, next to the store:
+
+    data/history/panel/panel.json     issuers, committed days and each issuer's committed rows
+    data/history/panel/dates.bin      datetime64[D], one entry per trading day
+    data/history/panel/last.bin       float64 days x issuers, row-major, NaN where missing
+    data/history/panel/avg.bin        ...
+    data/history/panel/quantity.bin
+    data/history/panel/turnover.bin
+    data/history/panel/mask.bin       bool days x issuers, True where the issuer has a row that day
+
+Matrices are row-major, so new trading days are appended to the end of every file;
+update() only reads the rows each issuer gained since the last build. Every scraper and the
+scheduler update the panel after a run, so build() and update() hold panel/panel.lock (a
+FileLock, like the store's writers) and never write the files from two processes at once.
+
+    python -m mse.panel build|update [--root data/history]
+    python -m mse.panel movers [--day 2024-11-08] [--top 10]
+    python -m mse.panel index [--from 2024-01-01] [--to 2024-11-08]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from mse.filelock import FileLock
+from mse.indicators import ffill, market_matrix
+from mse.storage import DEFAULT_ROOT, HistoryStore, _replace
+
+PANEL_FIELDS = ["last", "avg", "quantity", "turnover"]
+
+
+class Panel:
+    def __init__(self, store, root=None):
+        self.store = store
+        self.root = root or os.path.join(store.root, "panel")
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def lock(self):
+        return FileLock(self.path("panel.lock"))
+
+    # --- Reading ---
+    def meta(self):
+        try:
+            with open(self.path("panel.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"issuers": [], "days": 0, "rows": {}, "last_dates": {}}
+
+    def _map(self, name, dtype, meta=None):
+        meta = meta or self.meta()
+        days, issuers = meta["days"], len(meta["issuers"])
+        shape = (days,) if name == "dates" else (days, issuers)
+        if days == 0 or (issuers == 0 and name != "dates"):
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path(f"{name}.bin"), dtype=dtype, mode="r", shape=shape)
+
+    @property
+    def issuers(self):
+        return self.meta()["issuers"]
+
+    def dates(self):
+        return self._map("dates", "M8[D]")
+
+    def field(self, key):
+        """
+        Read-only days x issuers memory map of one field; NaN where an issuer has no row.
+        """
+        return self._map(key, "f8")
+
+    def mask(self):
+        return self._map("mask", "?")
+
+    def column(self, issuer, key="last"):
+        return self.field(key)[:, self.issuers.index(issuer)]
+
+    def span(self, start=None, end=None):
+        """
+        Row slice of the trading days in [start, end] (either bound may be None).
+        """
+        dates = self.dates()
+        first = 0 if start is None else np.searchsorted(dates, np.datetime64(start, "D"))
+        last = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, "D"), side="right")
+        return slice(first, last)
+
+    # --- Building ---
+    def build(self):
+        """
+        Rebuild the whole panel from the store. Returns the number of trading days.
+        """
+        with self.lock():
+            return self._build()
+
+    def _build(self):
+        market = self.store.load_market(["date"] + PANEL_FIELDS)
+        dates, issuers, matrices = market_matrix(market, PANEL_FIELDS)
+        mask = np.zeros((len(dates), len(issuers)), dtype=bool)
+        for column, issuer in enumerate(issuers):
+            mask[np.searchsorted(dates, market[issuer]["date"]), column] = True
+        os.makedirs(self.root, exist_ok=True)
+        _replace(self.path("dates.bin"), np.ascontiguousarray(dates).tobytes())
+        for key, matrix in matrices.items():
+            _replace(self.path(f"{key}.bin"), np.ascontiguousarray(matrix).tobytes())
+        _replace(self.path("mask.bin"), mask.tobytes())
+        self._commit(issuers, len(dates), market)
+        return len(dates)
+
+    def update(self):
+        """
+        Bring the panel up to date with the store by appending the new trading days.
+        Rows that fall on days already in the panel are written in place. The panel is rebuilt
+        when the issuer set changed, an issuer's stored history was rewritten, or a new day
+        would land before the panel's last day. Returns the number of days appended.
+        """
+        with self.lock():
+            return self._update()
+
+    def _update(self):
+        meta = self.meta()
+        entries = self.store.manifest.entries()
+        issuers = meta["issuers"]
+        if not issuers or sorted(entries) != issuers:
+            return self._build()
+
+        dates = self._map("dates", "M8[D]", meta)
+        new = {}
+        for column, issuer in enumerate(issuers):
+            rows, committed = entries[issuer]["rows"], meta["rows"][issuer]
+            if rows == committed:
+                continue
+            columns = self.store.read(issuer, ["date"] + PANEL_FIELDS)
+            last_date = meta["last_dates"][issuer]
+            if rows < committed or (committed and str(columns["date"][committed - 1]) != last_date):
+                return self._build()
+            new[column] = {key: np.asarray(values[committed:]) for key, values in columns.items()}
+        if not new:
+            return 0
+
+        new_dates = np.unique(np.concatenate([columns["date"] for columns in new.values()]))
+        appended = new_dates[new_dates > dates[-1]] if len(dates) else new_dates
+        past = new_dates[:len(new_dates) - len(appended)]
+        if len(past) and not np.isin(past, dates).all():
+            return self._build()
+
+        days, count = len(dates), len(issuers)
+        calendar = np.concatenate([dates, appended])
+        tail = {key: np.full((len(appended), count), np.nan) for key in PANEL_FIELDS}
+        tail_mask = np.zeros((len(appended), count), dtype=bool)
+        for column, columns in new.items():
+            positions = np.searchsorted(calendar, columns["date"])
+            later = positions >= days
+            for key in PANEL_FIELDS:
+                tail[key][positions[later] - days, column] = columns[key][later]
+            tail_mask[positions[later] - days, column] = True
+            if not later.all():
+                self._write_in_place(days, count, column, positions[~later],
+                                     {key: columns[key][~later] for key in PANEL_FIELDS})
+
+        self._append("dates.bin", days * 8, appended)
+        for key in PANEL_FIELDS:
+            self._append(f"{key}.bin", days * count * 8, tail[key])
+        self._append("mask.bin", days * count, tail_mask)
+        market = {issuer: self.store.read(issuer, ["date"]) for issuer in issuers}
+        self._commit(issuers, days + len(appended), market)
+        return len(appended)
+
+    def _write_in_place(self, days, count, column, positions, values):
+        for key in PANEL_FIELDS:
+            matrix = np.memmap(self.path(f"{key}.bin"), dtype="f8", mode="r+", shape=(days, count))
+            matrix[positions, column] = values[key]
+            matrix.flush()
+        mask = np.memmap(self.path("mask.bin"), dtype="?", mode="r+", shape=(days, count))
+        mask[positions, column] = True
+        mask.flush()
+
+    def _append(self, name, committed_bytes, values):
+        with open(self.path(name), "r+b") as f:
+            # Drop anything past the committed days, left over from an interrupted update.
+            f.truncate(committed_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _commit(self, issuers, days, market):
+        meta = {
+            "issuers": list(issuers),
+            "days": days,
+            "rows": {issuer: len(market[issuer]["date"]) for issuer in issuers},
+            "last_dates": {issuer: str(market[issuer]["date"][-1]) if len(market[issuer]["date"]) else None
+                           for issuer in issuers},
+        }
+        tmp_path = self.path("panel.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path("panel.json"))
+
+    # --- Cross-sectional queries ---
+    def returns(self, key="last", start=None, end=None):
+        """
+        Daily returns (days x issuers) on the days each issuer has a row, measured against its
+        previous row; NaN on days without a row.
+        """
+        rows = self.span(start, end)
+        prices = ffill(np.where(self.mask(), self.field(key), np.nan))
+        previous = np.full_like(prices, np.nan)
+        previous[1:] = prices[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = prices / previous - 1.0
+        returns[~self.mask() | ~np.isfinite(returns)] = np.nan
+        return returns[rows]
+
+    def equal_weight_index(self, start=None, end=None, base=100.0):
+        """
+        Equal-weight market index: every day moves by the mean return of the issuers that traded.
+        Returns (dates, index values).
+        """
+        returns = self.returns(start=start, end=end)
+        traded = ~np.isnan(returns)
+        with np.errstate(invalid="ignore"):
+            daily = np.where(traded.any(axis=1), np.nansum(returns, axis=1) / np.maximum(traded.sum(axis=1), 1), 0.0)
+        return self.dates()[self.span(start, end)], base * np.cumprod(1.0 + daily)
+
+    def correlation(self, start=None, end=None, min_periods=20):
+        """
+        Pairwise correlation matrix of daily returns over [start, end], using the days both
+        issuers traded; NaN for pairs with fewer than min_periods common days.
+        """
+        return correlation_matrix(self.returns(start=start, end=end), min_periods)
+
+    def rolling_correlation(self, window=60, min_periods=20, step=1, start=None, end=None):
+        """
+        Yield (date, correlation matrix) for every `step`-th window of `window` trading days.
+        """
+        returns = self.returns(start=start, end=end)
+        dates = self.dates()[self.span(start, end)]
+        for stop in range(window, len(returns) + 1, step):
+            yield dates[stop - 1], correlation_matrix(returns[stop - window:stop], min_periods)
+
+    def movers(self, day=None, top=10):
+        """
+        The issuers with the largest and smallest return on `day` (default: the last trading day).
+        Returns (gainers, losers) as lists of (issuer, return); raises ValueError when `day` is
+        not a trading day of the panel.
+        """
+        returns = self.returns()
+        dates = self.dates()
+        if day is None:
+            row = len(dates) - 1
+        else:
+            row = np.searchsorted(dates, np.datetime64(day, "D"))
+            if row == len(dates) or dates[row] != np.datetime64(day, "D"):
+                raise ValueError(f"{day} is not a trading day in the panel")
+        if row < 0:
+            return [], []
+        day_returns = returns[row]
+        traded = np.flatnonzero(~np.isnan(day_returns))
+        order = traded[np.argsort(day_returns[traded])]
+        issuers = self.issuers
+        gainers = [(issuers[i], float(day_returns[i])) for i in order[::-1][:top]]
+        losers = [(issuers[i], float(day_returns[i])) for i in order[:top]]
+        return gainers, losers
+
+
+def correlation_matrix(returns, min_periods=20):
+    """
+    Pairwise-complete correlation of the columns of a days x issuers matrix, computed with
+    matrix products instead of a loop over issuer pairs.
+    """
+    valid = (~np.isnan(returns)).astype("f8")
+    values = np.nan_to_num(returns)
+    counts = valid.T @ valid
+    sum_x = values.T @ valid
+    sum_xx = (values * values).T @ valid
+    sum_xy = values.T @ values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = sum_xy - sum_x * sum_x.T / counts
+        var_x = sum_xx - sum_x * sum_x / counts
+        correlation = covariance / np.sqrt(var_x * var_x.T)
+    correlation[counts < min_periods] = np.nan
+    return np.clip(correlation, -1.0, 1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the aligned dates x issuers panel.")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="rebuild the panel from the history store")
+    commands.add_parser("update", help="append the trading days added since the last build")
+    movers = commands.add_parser("movers", help="largest gainers and losers of a day")
+    movers.add_argument("--day")
+    movers.add_argument("--top", type=int, default=10)
+    index = commands.add_parser("index", help="equal-weight market index")
+    index.add_argument("--from", dest="start")
+    index.add_argument("--to", dest="end")
+    args = parser.parse_args()
+
+    panel = Panel(HistoryStore(args.root))
+    if args.command == "build":
+        print(f"Built panel with {panel.build()} trading days x {len(panel.issuers)} issuers")
+    elif args.command == "update":
+        print(f"Appended {panel.update()} trading days")
+    elif args.command == "movers":
+        try:
+            gainers, losers = panel.movers(args.day, args.top)
+        except ValueError as e:
+            parser.error(str(e))
+        for title, rows in (("Gainers", gainers), ("Losers", losers)):
+            print(title)
+            for issuer, change in rows:
+                print(f"  {issuer:>6} {change * 100:+7.2f}%")
+    elif args.command == "index":
+        dates, values = panel.equal_weight_index(args.start, args.end)
+        if len(dates):
+            print(f"{dates[0]} {values[0]:.2f} -> {dates[-1]} {values[-1]:.2f} ({(values[-1] / values[0] - 1) * 100:+.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Conversion of scraped mse.mk table rows into typed columns.
+
+Numbers on the exchange site use the Macedonian locale: "." separates thousands and
+"," separates decimals ("12.000,00"), and the Max/Min cells are blank on days without
+trades. Everything is converted once, at ingest time, in a single NumPy pass per batch.
+"""
+import html
+import re
+
+import numpy as np
+import pandas as pd
+
+from mse.htmltable import extract_cells, extract_options
+
+# (column name, key, dtype) for every table cell, in the order mse.mk renders them.
+FIELDS = [
+    ("Date", "date", np.dtype("M8[D]")),
+    ("Price for Last Transaction", "last", np.dtype("f8")),
+    ("Max Price", "max", np.dtype("f8")),
+    ("Min Price", "min", np.dtype("f8")),
+    ("Average Price", "avg", np.dtype("f8")),
+    ("% Change", "change", np.dtype("f8")),
+    ("Quantity", "quantity", np.dtype("i8")),
+    ("Market Volume (MKD)", "turnover", np.dtype("i8")),
+    ("Total Volume", "total_turnover", np.dtype("i8")),
+]
+COLUMN_KEYS = {column: key for column, key, _ in FIELDS}
+KEY_COLUMNS = {key: column for column, key, _ in FIELDS}
+DTYPES = {key: dtype for _, key, dtype in FIELDS}
+NUMERIC_KEYS = [key for _, key, _ in FIELDS[1:]]
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+def parse_numbers(values):
+    """
+    Convert an array (any shape) of MK-locale number strings to float64.
+    Blank cells become NaN.
+    """
+    text = np.char.strip(np.asarray(values, dtype=str))
+    text = np.char.replace(np.char.replace(text, ".", ""), ",", ".")
+    text = np.where(text == "", "nan", text)
+    return text.astype("f8")
+
+
+def parse_dates(values):
+    """
+    Convert "dd.m.yyyy" strings (the day/month are not always zero padded) to datetime64[D].
+    """
+    values = np.char.strip(np.asarray(values, dtype=str))
+    return pd.to_datetime(values, format=DATE_FORMAT).to_numpy().astype("M8[D]")
+
+
+def convert_cells(cells):
+    """
+    Convert a batch of rows, each a list of the nine cell strings, into {key: array}.
+    All numeric columns are converted together in one vectorized pass.
+    """
+    if len(cells) == 0:
+        return {key: np.empty(0, dtype=dtype) for key, dtype in DTYPES.items()}
+    table = np.asarray(cells, dtype=str)
+    columns = {"date": parse_dates(table[:, 0])}
+    numbers = parse_numbers(table[:, 1:])
+    for index, key in enumerate(NUMERIC_KEYS):
+        values = numbers[:, index]
+        if DTYPES[key].kind == "i":
+            values = np.nan_to_num(values).astype(DTYPES[key])
+        columns[key] = values
+    return columns
+
+
+def to_records(columns):
+    """
+    Turn typed columns back into the scraper's row dictionaries, with Python values.
+    """
+    dates = columns["date"].tolist()
+    values = {KEY_COLUMNS[key]: columns[key].tolist() for key in NUMERIC_KEYS}
+    records = []
+    for index, date in enumerate(dates):
+        record = {"Date": date, "Year": date.year, "Month": date.month}
+        for column, column_values in values.items():
+            record[column] = column_values[index]
+        records.append(record)
+    return records
+
+
+def row_cells(row):
+    """
+    Extract the stripped cell texts from a table row element (HTML <tr>).
+    """
+    return [cell.text.strip() for cell in row.select("td")]
+
+
+def parse_rows(rows):
+    """
+    Parse a batch of table row elements into typed records.
+    """
+    return to_records(convert_cells([row_cells(row) for row in rows]))
+
+
+def parse_row(row):
+    """
+    Extracts and organizes data from a table row element (HTML <tr>) to a typed dictionary.
+    """
+    return parse_rows([row])[0]
+
+
+def parse_columns(content):
+    """
+    Parse the rows of one symbolhistory results page straight into typed column arrays.
+    """
+    return convert_cells(extract_cells(content))
+
+
+def parse_records(content):
+    """
+    Parse the rows of one symbolhistory results page into typed records.
+    """
+    return to_records(parse_columns(content))
+
+
+NEXT_LINK = re.compile(r'<li[^>]*class="[^"]*\bnext\b[^"]*"[^>]*>\s*<a[^>]*href="([^"]*)"', re.IGNORECASE)
+
+
+def next_href(content):
+    """
+    Find the href of the pager's ".next > a" link without building a document tree,
+    so the next page can be requested before the current one is parsed.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    match = NEXT_LINK.search(content)
+    return html.unescape(match.group(1)) if match else None
+
+
+def parse_issuers(content):
+    """
+    Parse the issuer codes from the #Code <select> of a symbolhistory page.
+    Options that contain numbers (bonds) are filtered out.
+    """
+    return [option for option in extract_options(content) if not any(char.isdigit() for char in option)]
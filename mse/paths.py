@@ -0,0 +1,16 @@
+"""
+Location of the generated data shared by every script and service.
+
+The history store, the response cache, profiles and the scheduler state all live under one
+data root, so Домашнo_1, Домашна 2, Домашна 3 and Домашна_4 see the same store whatever
+folder they are started from. The root is data/ at the repository root unless the
+MSE_DATA_DIR environment variable names another folder.
+"""
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_ROOT = os.environ.get("MSE_DATA_DIR") or os.path.join(REPO_ROOT, "data")
+
+
+def data_path(*parts):
+    return os.path.join(DATA_ROOT, *parts)
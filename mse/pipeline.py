@@ -0,0 +1,114 @@
+"""
+Headless analysis pipeline that spreads issuers over a process pool.
+
+The market calendar is computed once in the caller; issuers are split into chunks and
+every worker process opens the history store itself, brings its chunk's indicators up to
+date (mse.streaming) and writes the analysis_<ISSUER>.csv files. Workers never log; each
+finished issuer is yielded back to the caller as its chunk completes, so progress can be
+reported from the caller's side while scraping and UI work stay in their own threads.
+
+    python -m mse.pipeline --root data/history --output data [--workers 8] [--chunk-size 10]
+"""
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from mse.parsing import KEY_COLUMNS
+from mse.storage import DEFAULT_ROOT, HistoryStore
+from mse.streaming import analyze_issuers, market_calendar
+
+
+def analysis_path(output_dir, issuer):
+    return os.path.join(output_dir, f"analysis_{issuer}.csv")
+
+
+def write_analysis(store, issuer, dates, column, results, path, append=False):
+    """
+    Write one issuer's column of the indicator matrices next to its price history.
+    With append=True only the issuer's rows on `dates` (the newly analysed days) are added.
+    Returns the number of rows written.
+    """
+    columns = store.read(issuer)
+    start = np.searchsorted(columns["date"], dates[0]) if append else 0
+    stop = np.searchsorted(columns["date"], dates[-1], side="right")
+    data = pd.DataFrame({KEY_COLUMNS[key]: values[start:stop] for key, values in columns.items()})
+    if data.empty:
+        return 0
+    rows = np.searchsorted(dates, data["Date"].to_numpy().astype("M8[D]"))
+    for name, matrix in results.items():
+        data[name] = matrix[rows, column]
+    if append:
+        data.to_csv(path, mode="a", header=False, index=False)
+    else:
+        data.to_csv(path, index=False)
+    return len(data)
+
+
+def analyze_chunk(root, issuers, calendar, output_dir, period=14, full=False):
+    """
+    Worker: analyse a chunk of issuers and write their analysis files.
+    Issuers without an analysis file yet are recomputed from scratch.
+    Returns [(issuer, rows written, recomputed)].
+    """
+    store = HistoryStore(root)
+    rebuild = set(issuers) if full else {issuer for issuer in issuers
+                                          if not os.path.exists(analysis_path(output_dir, issuer))}
+    finished = []
+    for dates, codes, results, recomputed in analyze_issuers(store, issuers, calendar, period, rebuild):
+        for column, issuer in enumerate(codes):
+            path = analysis_path(output_dir, issuer)
+            finished.append((issuer, write_analysis(store, issuer, dates, column, results, path, not recomputed),
+                             recomputed))
+    return finished
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run(store, issuers=None, output_dir="data", period=14, full=False, workers=None, chunk_size=None):
+    """
+    Analyse `issuers` (default: every issuer in the store) on `workers` processes
+    (default: one per core) and yield (issuer, rows written, recomputed) as chunks finish.
+    """
+    issuers = sorted(store.issuers() if issuers is None else [issuer for issuer in issuers if store.exists(issuer)])
+    if not issuers:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    calendar = market_calendar(store)
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per worker keeps the pool busy when some issuers take longer than others
+    chunk_size = chunk_size or max(1, math.ceil(len(issuers) / (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_chunk, store.root, chunk, calendar, output_dir, period, full)
+                   for chunk in chunked(issuers, chunk_size)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the indicator analysis for every issuer on a process pool.")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--output", default="data", help="folder for the analysis_<ISSUER>.csv files")
+    parser.add_argument("--workers", type=int, default=None, help="default: number of cores")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--period", type=int, default=14)
+    parser.add_argument("--full", action="store_true", help="recompute every issuer from scratch")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    count = rows = 0
+    for issuer, written, recomputed in run(HistoryStore(args.root), None, args.output, args.period, args.full,
+                                           args.workers, args.chunk_size):
+        count += 1
+        rows += written
+    print(f"Analysed {count} issuers ({rows} rows written) in {time.perf_counter() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
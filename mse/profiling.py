@@ -0,0 +1,260 @@
+"""
+Per-stage CPU and memory profiling for scrape and analysis runs (the --profile option).
+
+A RunProfiler writes one directory per run under data/profiles/<timestamp>-<name>/. Code
+marks its stages with `with profiler.stage("scrape"):` and every stage gets:
+
+    <stage>.folded      collapsed stacks of all threads (flamegraph.pl, speedscope, difffolded.pl)
+    <stage>.top.txt     functions by self and total samples
+    <stage>.memory.txt  top allocating lines over the stage (tracemalloc, --profile-memory)
+    <stage>.pstats      cProfile statistics, in "cprofile" mode only (python -m pstats <file>)
+    summary.json        wall and CPU time, samples and memory peak of every stage
+
+The default "sample" mode reads the stacks of all threads from a background thread every
+`interval` seconds. It is a wall-clock profile (waiting threads are sampled as well, which
+is where a scrape spends its time) and its cost does not depend on how many calls the code
+makes, so it can be left on in staging. "cprofile" mode adds deterministic cProfile data for
+the stage's thread and every thread started during the stage, at a much higher overhead.
+From Python 3.12 cProfile runs on sys.monitoring, which sees every thread but allows only one
+active profiler, so one profile covers the stage; older versions need one per thread.
+Memory tracing slows allocation-heavy code down severalfold (a scrape took 2.7x as long), so
+it is only switched on by --profile-memory. Worker processes (mse.pipeline) are not followed.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from mse.paths import data_path
+
+DEFAULT_ROOT = data_path("profiles")
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+MODES = ["sample", "cprofile"]
+INTERVAL = 0.01
+TOP = 40
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_group(name):
+    # ThreadPoolExecutor-0_3 and ThreadPoolExecutor-0_7 are the same kind of thread
+    return re.sub(r"[-_]\d+", "", name)
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stage = None
+        self.stacks = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            stage = self.stage
+            if stage is None:
+                continue
+            counts = self.stacks.setdefault(stage, Counter())
+            names = {thread.ident: _thread_group(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class RunProfiler:
+    def __init__(self, name, mode="sample", root=DEFAULT_ROOT, interval=INTERVAL, memory=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {MODES}")
+        self.name = name
+        self.mode = mode
+        self.memory = memory
+        self.run_dir = os.path.join(root, f"{datetime.now():%Y%m%d-%H%M%S}-{name}")
+        self.stages = {}
+        self._profiles = {}
+        self._cprofile_active = False
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._sampler = _Sampler(interval)
+        self._sampler.start()
+        self._tracing = memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            # One frame per allocation keeps the tracing cost down; it is enough to name the line
+            tracemalloc.start(1)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Profile the block as stage `name`; a stage entered again accumulates into the same reports.
+        """
+        previous = self._sampler.stage
+        self._sampler.stage = name
+        before = None
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        # A nested stage is covered by the profile of the stage around it
+        profile = self._start_cprofile(name) if self.mode == "cprofile" and not self._cprofile_active else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile is not None:
+                self._stop_cprofile(profile)
+            stats = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            stats["calls"] += 1
+            if before is not None:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats["memory_peak"] = max(stats.get("memory_peak", 0), peak)
+                self._memory.setdefault(name, []).append((before, tracemalloc.take_snapshot()))
+            self._sampler.stage = previous
+
+    def _start_cprofile(self, name):
+        profiles = self._profiles.setdefault(name, [])
+
+        def start_thread_profile(*args):
+            # Called once in every thread started during the stage; enable() replaces this hook
+            profile = cProfile.Profile()
+            with self._lock:
+                profiles.append(profile)
+            profile.enable()
+
+        if PER_THREAD_CPROFILE:
+            threading.setprofile(start_thread_profile)
+        profile = cProfile.Profile()
+        profiles.append(profile)
+        profile.enable()
+        self._cprofile_active = True
+        return profile
+
+    def _stop_cprofile(self, profile):
+        profile.disable()
+        self._cprofile_active = False
+        if PER_THREAD_CPROFILE:
+            threading.setprofile(None)
+
+    def _write_samples(self, stage, counts):
+        with open(os.path.join(self.run_dir, f"{stage}.folded"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f"{stack} {count}\n")
+
+        total = sum(counts.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in counts.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames[1:]):
+                inclusive[frame] += count
+        with open(os.path.join(self.run_dir, f"{stage}.top.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{total} samples\n\n{'self':>8} {'total':>8}  function\n")
+            for frame, count in own.most_common(TOP):
+                f.write(f"{count / total:>8.1%} {inclusive[frame] / total:>8.1%}  {frame}\n")
+
+    def _write_memory(self, stage, snapshots):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        totals = Counter()
+        for before, after in snapshots:
+            for diff in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno"):
+                totals[str(diff.traceback[0])] += diff.size_diff
+        with open(os.path.join(self.run_dir, f"{stage}.memory.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Peak traced memory: {self.stages[stage]['memory_peak'] / 2 ** 20:.1f} MiB\n\n")
+            for line, size in totals.most_common(TOP):
+                f.write(f"{size / 2 ** 10:>12.1f} KiB  {line}\n")
+        self.stages[stage]["memory_net"] = sum(totals.values())
+
+    def close(self):
+        """
+        Stop profiling and write the reports. Returns the run directory.
+        """
+        self._sampler.stop()
+        if self._tracing:
+            tracemalloc.stop()
+        os.makedirs(self.run_dir, exist_ok=True)
+        for stage, counts in self._sampler.stacks.items():
+            self._write_samples(stage, counts)
+            if stage in self.stages:
+                self.stages[stage]["samples"] = sum(counts.values())
+        for stage, snapshots in self._memory.items():
+            self._write_memory(stage, snapshots)
+        for stage, profiles in self._profiles.items():
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(os.path.join(self.run_dir, f"{stage}.pstats"))
+        summary = {"name": self.name, "mode": self.mode, "interval": self._sampler.interval, "stages": self.stages}
+        with open(os.path.join(self.run_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return self.run_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is off, so callers can mark stages unconditionally.
+    """
+    run_dir = None
+
+    @contextmanager
+    def stage(self, name):
+        yield self
+
+    def close(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+OFF = NullProfiler()
+
+
+def create(name, mode=None, **kwargs):
+    """
+    RunProfiler for a --profile value (None or "" means profiling is off).
+    """
+    return RunProfiler(name, mode, **kwargs) if mode else OFF
+
+
+def from_args(name, args):
+    """
+    Profiler for the options added by add_arguments; args may be None.
+    """
+    if args is None:
+        return OFF
+    return create(name, args.profile, memory=args.profile_memory)
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", nargs="?", const="sample", choices=MODES, default=None,
+                        help="profile every stage into data/profiles/ (sample: low overhead; cprofile: deterministic)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="with --profile: also trace allocations per stage (slow)")
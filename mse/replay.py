@@ -0,0 +1,186 @@
+"""
+Offline stand-in for the mse.mk symbolhistory pages, generated from the CSV corpus.
+
+    GET  .../symbolhistory/{code}   page with the #Code <select> of every issuer
+    POST .../symbolhistory/{code}   #resultsTable for Code/FromDate/ToDate, newest first,
+                                    split into pages linked through ".next > a"
+    GET  /issuers                   JSON issuer list, like Домашна_4/issuer_service.py
+
+Latency, error rate and page size are configurable, so scrapers can be benchmarked
+without touching the real exchange:
+
+    python -m mse.replay Домашнo_1/data --port 8800 --latency 0.05 --error-rate 0.01 --page-size 100
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Bond codes contain digits; the scrapers are expected to filter them out of the list
+BOND_CODES = ["RM01", "RMDEN21"]
+
+
+def load_corpus(csv_dir, limit=None):
+    """
+    Read {issuer}.csv files into {issuer: [(date, [cell strings])]} sorted by date.
+    Cell strings are kept exactly as scraped, in mse.mk's MK number format.
+    """
+    corpus = {}
+    paths = sorted(path for path in glob.glob(os.path.join(csv_dir, "*.csv"))
+                   if not os.path.basename(path).startswith("analysis_"))
+    for path in paths[:limit]:
+        issuer = os.path.splitext(os.path.basename(path))[0]
+        rows = {}
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                # Date, Year, Month, then the eight value cells
+                rows[datetime.strptime(row[0], "%d.%m.%Y").date()] = [row[0]] + row[3:]
+        corpus[issuer] = sorted(rows.items())
+    return corpus
+
+
+class ReplayStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.pages = 0
+            self.rows = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "pages": self.pages, "rows": self.rows}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if not self._admit():
+            return
+        path = urlsplit(self.path).path.rstrip("/")
+        if path.endswith("/issuers"):
+            self._send(json.dumps(sorted(self.server.corpus)).encode("utf-8"), "application/json")
+        elif "/symbolhistory/" in path:
+            options = "".join(f"<option>{code}</option>" for code in sorted(self.server.corpus) + BOND_CODES)
+            self._send(f'<html><body><form><select id="Code">{options}</select></form>'
+                       f'<table id="resultsTable"><tbody></tbody></table></body></html>'.encode("utf-8"))
+        else:
+            self._send(b"Not found", status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        if not self._admit():
+            return
+        url = urlsplit(self.path)
+        if "/symbolhistory/" not in url.path:
+            self._send(b"Not found", status=404)
+            return
+        form = {key: values[0] for key, values in parse_qs(body).items()}
+        code = form.get("Code") or url.path.rstrip("/").rsplit("/", 1)[-1]
+        try:
+            from_date = datetime.strptime(form["FromDate"], "%d.%m.%Y").date()
+            to_date = datetime.strptime(form["ToDate"], "%d.%m.%Y").date()
+        except (KeyError, ValueError):
+            self._send(b"Bad request", status=400)
+            return
+        page = int(parse_qs(url.query).get("page", ["1"])[0])
+
+        # mse.mk lists the newest day first
+        rows = [cells for date, cells in reversed(self.server.corpus.get(code, [])) if from_date <= date <= to_date]
+        size = self.server.page_size
+        page_rows = rows[(page - 1) * size:page * size]
+        table = "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>" for cells in page_rows)
+        pager = ""
+        if page * size < len(rows):
+            pager = f'<ul class="pager"><li class="next"><a href="{url.path}?page={page + 1}">&gt;</a></li></ul>'
+        self.server.stats.add(pages=1, rows=len(page_rows))
+        self._send(f'<html><body><table id="resultsTable"><thead><tr><th>Датум</th></tr></thead>'
+                   f'<tbody>{table}</tbody></table>{pager}</body></html>'.encode("utf-8"))
+
+    def _admit(self):
+        """
+        Count the request, apply the configured latency and maybe answer with an injected 503.
+        """
+        self.server.stats.add(requests=1)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.server.stats.add(errors=1)
+            self._send(b"Service unavailable", status=503)
+            return False
+        return True
+
+    def _send(self, payload, content_type="text/html; charset=utf-8", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, corpus, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, page_size=100):
+        super().__init__((host, port), ReplayHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.stats = ReplayStats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mse.mk symbolhistory pages from the CSV corpus.")
+    parser.add_argument("csv_dir")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--page-size", type=int, default=100, help="table rows per page")
+    parser.add_argument("--issuers", type=int, default=None, help="serve only the first N issuers")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.csv_dir, args.issuers)
+    server = ReplayServer(corpus, args.host, args.port, args.latency, args.error_rate, args.page_size)
+    print(f"Serving {len(corpus)} issuers on {server.base_url}/mk/stats/symbolhistory/{{code}}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Trading-calendar-aware scheduler for the daily incremental scrape.
+
+Instead of sleeping 24 hours between full passes, the scheduler wakes up once per trading
+session, after the exchange has closed, and only visits issuers that still miss that session:
+
+- TradingCalendar knows the Macedonian Stock Exchange's non-trading days: weekends, the fixed
+  public holidays, the Orthodox Easter holidays and Sunday holidays moved to the Monday. Days
+  already in the store are taken from the data itself, which also covers lunar holidays.
+- An issuer is skipped when its store watermark or the session it was last checked for is
+  already the current session, so issuers that did not trade are not fetched again and again.
+- The issuers that traded the most (turnover over the last weeks) go first; the rest are
+  spread over a window, each start moved by random jitter.
+- The session and the issuers done for it are saved to a JSON file after every issuer, so a
+  restart continues the interrupted pass instead of rescanning the market.
+"""
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# The run time after the close is shared with plan_updates(), which decides when today counts
+from mse.manifest import RUN_AFTER, TIMEZONE
+from mse.panel import Panel
+from mse.paths import data_path
+from mse.streaming import market_calendar
+
+DEFAULT_STATE_PATH = data_path("scheduler.json")
+START_JITTER = 15 * 60  # seconds added at random to the start of a pass
+WINDOW = 20 * 60  # seconds over which the issuers of one pass are spread
+ISSUER_JITTER = 30  # seconds of random shift for every issuer's start
+WORKERS = 8
+RETRY_DELAY = 30 * 60  # seconds before issuers that failed are tried again
+MAX_ATTEMPTS = 3
+ACTIVITY_DAYS = 30  # calendar days of turnover used to order the issuers
+
+FIXED_HOLIDAYS = [(1, 1), (1, 6), (1, 7), (1, 19), (5, 1), (5, 24), (8, 2), (8, 28), (9, 8), (10, 11),
+                  (10, 23), (12, 8)]
+# Days relative to Orthodox Easter Sunday: Good Friday, Easter Monday, the Friday before Pentecost
+EASTER_HOLIDAYS = [-2, 1, 47]
+
+
+def orthodox_easter(year):
+    """
+    Orthodox Easter Sunday of `year` in the Gregorian calendar (Meeus' Julian algorithm).
+    """
+    a, b, c = year % 4, year % 7, year % 19
+    d = (19 * c + 15) % 30
+    e = (2 * a + 4 * b - d + 34) % 7
+    month, day = divmod(d + e + 114, 31)
+    # The Julian calendar is 13 days behind the Gregorian one from 1900 to 2099
+    return date(year, month, day + 1) + timedelta(days=13)
+
+
+def holidays(year):
+    days = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    easter = orthodox_easter(year)
+    days.update(easter + timedelta(days=offset) for offset in EASTER_HOLIDAYS)
+    # A holiday that falls on a Sunday is taken on the Monday
+    days.update(day + timedelta(days=1) for day in list(days) if day.weekday() == 6)
+    return days
+
+
+class TradingCalendar:
+    def __init__(self, observed=(), extra_holidays=()):
+        """
+        observed: trading days seen in the data; days up to the last of them are decided
+        by the data, later days by the holiday rules.
+        """
+        self.observed = {day.astype(object) if isinstance(day, np.datetime64) else day for day in observed}
+        self.observed_until = max(self.observed) if self.observed else None
+        self.extra_holidays = set(extra_holidays)
+        self._holidays = {}
+
+    @classmethod
+    def from_store(cls, store, extra_holidays=()):
+        return cls(market_calendar(store), extra_holidays)
+
+    def is_trading_day(self, day):
+        if self.observed_until is not None and day <= self.observed_until:
+            return day in self.observed
+        if day.weekday() >= 5 or day in self.extra_holidays:
+            return False
+        if day.year not in self._holidays:
+            self._holidays[day.year] = holidays(day.year)
+        return day not in self._holidays[day.year]
+
+    def previous(self, day):
+        """
+        The last trading day on or before `day`.
+        """
+        while not self.is_trading_day(day):
+            day -= timedelta(days=1)
+        return day
+
+    def next(self, day):
+        """
+        The first trading day after `day`.
+        """
+        day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+
+def now():
+    return datetime.now(TIMEZONE)
+
+
+class ScrapeScheduler:
+    def __init__(self, store, update_issuer, list_issuers=None, state_path=DEFAULT_STATE_PATH, calendar=None,
+                 run_after=RUN_AFTER, window=WINDOW, workers=WORKERS, log=print):
+        """
+        update_issuer(issuer) fetches the issuer's missing rows into `store` and returns True
+        when it succeeded; anything else (or raising) marks the issuer as failed, so it is
+        retried after RETRY_DELAY. list_issuers() returns the current issuer codes; the
+        issuers already in the store are used when it is missing or fails.
+        """
+        self.store = store
+        self.update_issuer = update_issuer
+        self.list_issuers = list_issuers
+        self.state_path = state_path
+        self.calendar = calendar or TradingCalendar.from_store(store)
+        self.run_after = run_after
+        self.window = window
+        self.workers = workers
+        self.log = log
+        self.state = self.load_state()
+        self._lock = threading.Lock()
+
+    # --- state ---
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"session": None, "attempts": 0, "checked": {}}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    # --- planning ---
+    def current_session(self, moment=None):
+        """
+        The latest session whose data should be available at `moment`.
+        """
+        moment = moment or now()
+        today = moment.date()
+        if self.calendar.is_trading_day(today) and moment.time() >= self.run_after:
+            return today
+        return self.calendar.previous(today - timedelta(days=1))
+
+    def next_run(self, moment=None):
+        """
+        When the next pass should start: now if the current session has not been run or its
+        pass was interrupted, after RETRY_DELAY if issuers failed, otherwise after the close
+        of the next trading day, plus jitter.
+        """
+        moment = moment or now()
+        session = self.current_session(moment)
+        if self.state["session"] != session.isoformat() or "finished_at" not in self.state:
+            return moment
+        if self.state.get("failed") and self.state["attempts"] < MAX_ATTEMPTS:
+            retry_at = datetime.fromisoformat(self.state["finished_at"]) + timedelta(seconds=RETRY_DELAY)
+            return max(moment, retry_at)
+        day = self.calendar.next(session)
+        start = datetime.combine(day, self.run_after, moment.tzinfo)
+        return start + timedelta(seconds=random.uniform(0, START_JITTER))
+
+    def _issuers(self):
+        issuers = None
+        if self.list_issuers is not None:
+            try:
+                issuers = self.list_issuers()
+            except Exception as e:
+                self.log(f"Fetching the issuer list failed, using the stored issuers: {e}")
+        return issuers or self.store.issuers()
+
+    def _watermark(self, issuer):
+        last_date = self.store.meta(issuer)["last_date"]
+        checked = self.state["checked"].get(issuer)
+        marks = [datetime.strptime(mark, "%Y-%m-%d").date() for mark in (last_date, checked) if mark]
+        return max(marks) if marks else None
+
+    def pending(self, session, issuers=None):
+        """
+        Issuers that still miss `session`, the most active first.
+        """
+        issuers = self._issuers() if issuers is None else issuers
+        behind = [issuer for issuer in issuers if (self._watermark(issuer) or date.min) < session]
+        since = np.datetime64(session - timedelta(days=ACTIVITY_DAYS), "D")
+        activity = {issuer: int(self.store.range(issuer, since, None, ["turnover"])["turnover"].sum())
+                    for issuer in behind}
+        return sorted(behind, key=lambda issuer: -activity[issuer])
+
+    # --- running ---
+    def run_session(self, session, stop=None):
+        """
+        Update every issuer that misses `session`, spread over the window. Returns the
+        issuers that failed.
+        """
+        stop = stop or threading.Event()
+        if self.state["session"] != session.isoformat():
+            self.state = {"session": session.isoformat(), "attempts": 0, "checked": self.state["checked"]}
+        self.state.pop("finished_at", None)
+        self.state["attempts"] += 1
+        self.save_state()
+        issuers = self.pending(session)
+        self.log(f"Session {session}: updating {len(issuers)} issuers (attempt {self.state['attempts']}).")
+
+        failed = []
+        # Equal slots over the window for the issuers in priority order, each shifted by jitter
+        step = self.window / max(1, len(issuers))
+        start = now()
+        due = [start + timedelta(seconds=max(0.0, i * step + random.uniform(-ISSUER_JITTER, ISSUER_JITTER)))
+               for i in range(len(issuers))]
+
+        def visit(issuer, at):
+            if stop.wait(max(0.0, (at - now()).total_seconds())):
+                return
+            try:
+                ok = self.update_issuer(issuer) is True
+            except Exception as e:
+                self.log(f"Failed to update data for {issuer}: {e}")
+                ok = False
+            with self._lock:
+                if ok:
+                    self.state["checked"][issuer] = session.isoformat()
+                    self.save_state()
+                else:
+                    failed.append(issuer)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for issuer, at in zip(issuers, due):
+                executor.submit(visit, issuer, at)
+
+        if stop.is_set():
+            # Interrupted: the next start continues this session with the issuers not done
+            return failed
+        self.state["finished_at"] = now().isoformat()
+        self.state["failed"] = sorted(failed)
+        self.save_state()
+        if issuers:
+            self.log(f"Panel updated with {Panel(self.store).update()} new trading days.")
+        self.log(f"Session {session} done, {len(failed)} issuers failed.")
+        return failed
+
+    def run_forever(self, stop=None):
+        """
+        Wait for each run time and run the session; returns when `stop` is set.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            at = self.next_run()
+            delay = (at - now()).total_seconds()
+            if delay > 0:
+                self.log(f"Next scheduled update at {at:%Y-%m-%d %H:%M}.")
+                if stop.wait(delay):
+                    break
+            # The calendar learns the days that were actually traded from the data
+            self.calendar = TradingCalendar.from_store(self.store, self.calendar.extra_holidays)
+            self.run_session(self.current_session(), stop)
@@ -0,0 +1,71 @@
+"""
+Request coalescing for the Домашна_4 services.
+
+SingleFlight.do(key, fn) runs fn once per key at a time: threads that ask for a key while
+its call is still running wait for that call and get the same result (or exception)
+instead of starting their own upstream request.
+
+ResultCache keeps finished results with a per-entry expiry, so closed periods can be kept
+for good while the current one is refreshed. Given max_entries it keeps only that many,
+dropping the least recently used.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+
+class ResultCache:
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl=None):
+        """
+        Store a result; ttl=None keeps it until it is evicted or the process exits.
+        """
+        with self._lock:
+            self._entries[key] = (None if ttl is None else time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
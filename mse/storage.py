@@ -0,0 +1,357 @@
+"""
+Columnar history store for issuer price data.
+
+Every issuer gets its own directory with one raw binary file per column, which is read
+back with numpy.fromfile instead of re-parsing the Macedonian-formatted CSV text. Columns
+are read into memory rather than memory-mapped: a map keeps a file descriptor open for as
+long as it lives, and the whole market is well over a thousand column files:
+
+    data/history/ALK/date.bin      datetime64[D]
+    data/history/ALK/last.bin      float64
+    ...
+    data/history/manifest.json     rows, last date and checksums for every issuer
+
+Writers of an issuer hold its data/history/<ISSUER>/.lock file lock (mse.filelock), so
+several processes can append to one store.
+
+data/ is the shared data root of mse.paths (MSE_DATA_DIR). Run
+`python -m mse.storage migrate <csv_dir>` once to convert an existing folder of CSV files.
+"""
+import argparse
+import glob
+import os
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from mse import metrics
+from mse.filelock import FileLock
+from mse.manifest import Manifest
+from mse.parsing import DTYPES, FIELDS, KEY_COLUMNS, parse_dates, parse_numbers
+from mse.paths import data_path
+
+DEFAULT_ROOT = data_path("history")
+
+
+def frame_dates(frame):
+    """
+    The Date column of a DataFrame as datetime64[D], parsed from dd.mm.yyyy text if needed.
+    """
+    dates = frame["Date"]
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.to_numpy().astype("M8[D]")
+    if len(dates) and isinstance(dates.iloc[0], str):
+        return parse_dates(dates.to_numpy())
+    return pd.to_datetime(dates).to_numpy().astype("M8[D]")
+
+
+def to_columns(frame):
+    """
+    Turn a DataFrame with the scraper's column names into a dict of typed arrays,
+    sorted by date with duplicate dates removed (the last occurrence wins).
+    String columns are parsed as MK-locale text; missing columns are filled with NaN / 0.
+    """
+    columns = {"date": frame_dates(frame)}
+    for column, key, dtype in FIELDS[1:]:
+        if column not in frame:
+            values = np.full(len(frame), np.nan)
+        elif pd.api.types.is_numeric_dtype(frame[column]):
+            values = frame[column].to_numpy(dtype="f8")
+        else:
+            values = parse_numbers(frame[column].fillna("").to_numpy())
+        if dtype.kind == "i":
+            values = np.nan_to_num(values).astype(dtype)
+        columns[key] = values
+
+    return sort_unique(columns)
+
+
+def sort_unique(columns):
+    """
+    Sort a dict of column arrays by date and drop duplicate dates.
+    The last occurrence of a date wins, so re-scraped rows replace stored ones.
+    """
+    dates = columns["date"]
+    order = np.argsort(dates, kind="stable")
+    sorted_dates = dates[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = sorted_dates[1:] != sorted_dates[:-1]
+    order = order[keep]
+    return {key: values[order] for key, values in columns.items()}
+
+
+def to_day(value):
+    """
+    Convert a date given as "dd.mm.yyyy" or ISO text, a date / datetime / Timestamp or a
+    numpy datetime64 into a datetime64[D].
+    """
+    if isinstance(value, str) and "." in value:
+        return parse_dates(np.array([value.strip()]))[0]
+    return pd.Timestamp(value).to_datetime64().astype("M8[D]")
+
+
+def read_history_csv(path):
+    """
+    Read one of the scraper's CSV files (MK number formatting) into a typed DataFrame.
+    """
+    return pd.read_csv(path, dtype={"Date": str}, thousands=".", decimal=",", encoding="utf-8-sig")
+
+
+class HistoryStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self.manifest = Manifest(root)
+        # (issuer, key) -> (rows, checksum, array), so repeated reads skip reading the files again
+        self._maps = {}
+
+    def path(self, issuer, name=""):
+        return os.path.join(self.root, issuer, name)
+
+    def lock(self, issuer):
+        """
+        Lock held while an issuer's column files and manifest entry are rewritten.
+        """
+        return FileLock(self.path(issuer, ".lock"))
+
+    def issuers(self):
+        return sorted(self.manifest.entries())
+
+    def exists(self, issuer):
+        return self.meta(issuer)["rows"] > 0
+
+    def meta(self, issuer):
+        """
+        Return the committed state of an issuer from the manifest:
+        {"rows": n, "last_date": "yyyy-mm-dd" or None, "checksums": {key: crc32}}.
+        """
+        return self.manifest.entry(issuer)
+
+    def rows(self, issuer):
+        return self.meta(issuer)["rows"]
+
+    def read(self, issuer, fields=None):
+        """
+        Return {file key: array} for an issuer. The arrays are read-only and shared with
+        later reads until the issuer's next write.
+        """
+        return self._map(issuer, self.meta(issuer), fields)
+
+    def _map(self, issuer, meta, fields=None):
+        rows = meta["rows"]
+        columns = {}
+        for key in fields or DTYPES:
+            dtype = DTYPES[key]
+            if rows == 0:
+                columns[key] = np.empty(0, dtype=dtype)
+                continue
+            # The checksum changes with every committed write, so a cached column is never stale
+            checksum = meta["checksums"].get(key)
+            cached = self._maps.get((issuer, key))
+            if cached is None or cached[0] != rows or cached[1] != checksum:
+                # count= leaves out bytes past the committed rows of an interrupted append
+                values = np.fromfile(self.path(issuer, f"{key}.bin"), dtype=dtype, count=rows)
+                values.flags.writeable = False
+                cached = self._maps[(issuer, key)] = (rows, checksum, values)
+            columns[key] = cached[2]
+        return columns
+
+    def row_range(self, issuer, start=None, end=None):
+        """
+        Slice of the rows dated within [start, end] (inclusive; either bound may be None),
+        found by binary search over the sorted date column viewed as integer day numbers.
+        """
+        keys = self.read(issuer, ["date"])["date"].view("i8")
+        first = 0 if start is None else int(np.searchsorted(keys, to_day(start).view("i8")))
+        stop = len(keys) if end is None else int(np.searchsorted(keys, to_day(end).view("i8"), side="right"))
+        return slice(first, max(first, stop))
+
+    def range(self, issuer, start=None, end=None, fields=None):
+        """
+        Return {file key: array} for the rows dated within [start, end]. The arrays are
+        zero-copy views into the cached columns, so the cost does not grow with the history.
+        """
+        rows = self.row_range(issuer, start, end)
+        return {key: values[rows] for key, values in self.read(issuer, fields).items()}
+
+    def range_frame(self, issuer, start=None, end=None, fields=None):
+        """
+        Like frame(), limited to the rows dated within [start, end].
+        """
+        columns = self.range(issuer, start, end, fields)
+        return pd.DataFrame({KEY_COLUMNS[key]: values for key, values in columns.items()})
+
+    def frame(self, issuer, fields=None):
+        """
+        Return an issuer's history as a DataFrame with the scraper's column names.
+        """
+        columns = self.read(issuer, fields)
+        return pd.DataFrame({KEY_COLUMNS[key]: values for key, values in columns.items()})
+
+    def last_date(self, issuer):
+        last_date = self.meta(issuer)["last_date"]
+        return pd.Timestamp(last_date) if last_date else None
+
+    def load_market(self, fields=None):
+        entries = self.manifest.entries()
+        return {issuer: self._map(issuer, entry, fields) for issuer, entry in sorted(entries.items())}
+
+    def write(self, issuer, frame):
+        """
+        Replace an issuer's history with the rows in `frame`.
+        Each column file is written next to its target and renamed into place.
+        """
+        columns = to_columns(frame)
+        with self.lock(issuer):
+            self._rewrite(issuer, columns)
+        return len(columns["date"])
+
+    def _rewrite(self, issuer, columns):
+        os.makedirs(self.path(issuer), exist_ok=True)
+        checksums = {}
+        for key, values in columns.items():
+            payload = np.ascontiguousarray(values).tobytes()
+            _replace(self.path(issuer, f"{key}.bin"), payload)
+            checksums[key] = zlib.crc32(payload)
+        self._commit(issuer, len(columns["date"]), columns["date"], checksums)
+
+    def append(self, issuer, frame):
+        """
+        Append the rows in `frame` that are newer than the issuer's watermark (its last stored date).
+        Rows are deduplicated on Date; older or already stored dates are dropped.
+
+        Only the new rows are written. Column files are extended in place and the append
+        becomes visible when the manifest is atomically replaced with the new row count, so a
+        crash mid-append leaves the previous history intact. Returns the number of rows added.
+        """
+        with metrics.timed("write", issuer):
+            added = self._append(issuer, to_columns(frame))
+        metrics.ROWS.inc(added, stage="write", issuer=issuer)
+        return added
+
+    def _append(self, issuer, columns):
+        with self.lock(issuer):
+            meta = self.meta(issuer)
+            if meta["last_date"]:
+                newer = columns["date"] > np.datetime64(meta["last_date"], "D")
+                columns = {key: values[newer] for key, values in columns.items()}
+            if len(columns["date"]):
+                self._extend(issuer, meta, columns)
+        return len(columns["date"])
+
+    def _extend(self, issuer, meta, columns):
+        os.makedirs(self.path(issuer), exist_ok=True)
+        checksums = dict(meta["checksums"])
+        for key, values in columns.items():
+            path = self.path(issuer, f"{key}.bin")
+            payload = np.ascontiguousarray(values).tobytes()
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                # Drop anything past the committed rows, left over from an interrupted append.
+                f.truncate(meta["rows"] * DTYPES[key].itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # CRC32 can be extended with the appended bytes alone.
+            checksums[key] = zlib.crc32(payload, checksums.get(key, 0))
+        self._commit(issuer, meta["rows"] + len(columns["date"]), columns["date"], checksums)
+
+    def merge(self, issuer, frame):
+        """
+        Add the rows in `frame` whose dates are not stored yet, including dates before the
+        watermark that append() would drop; rows of dates already stored are left out.
+
+        When every new date is past the watermark the rows are appended in place; otherwise
+        the issuer's column files are rewritten with the rows merged in. Returns the dates
+        that were added.
+        """
+        with metrics.timed("write", issuer):
+            added = self._merge(issuer, to_columns(frame))
+        metrics.ROWS.inc(len(added), stage="write", issuer=issuer)
+        return added
+
+    def _merge(self, issuer, columns):
+        with self.lock(issuer):
+            meta = self.meta(issuer)
+            stored = self._map(issuer, meta)
+            missing = ~np.isin(columns["date"], stored["date"])
+            columns = {key: values[missing] for key, values in columns.items()}
+            if len(columns["date"]) == 0:
+                return columns["date"]
+            if meta["rows"] == 0 or columns["date"][0] > stored["date"][-1]:
+                self._extend(issuer, meta, columns)
+            else:
+                self._rewrite(issuer, sort_unique({key: np.concatenate([stored[key], values])
+                                                   for key, values in columns.items()}))
+        return columns["date"]
+
+    def verify(self, issuer):
+        """
+        Recompute the column checksums from disk and compare them with the manifest.
+        """
+        meta = self.meta(issuer)
+        for key, values in self.read(issuer).items():
+            if zlib.crc32(np.ascontiguousarray(values).tobytes()) != meta["checksums"].get(key, 0):
+                return False
+        return True
+
+    def _commit(self, issuer, rows, dates, checksums):
+        last_date = str(dates[-1]) if len(dates) else None
+        self.manifest.update(issuer, {"rows": rows, "last_date": last_date, "checksums": checksums})
+
+
+def _replace(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def migrate_csv_dir(csv_dir, store):
+    """
+    One-shot conversion of a folder of {issuer}.csv files into the store.
+    Analysis outputs (analysis_*.csv) are skipped.
+    """
+    migrated = {}
+    for path in sorted(glob.glob(os.path.join(csv_dir, "*.csv"))):
+        issuer = os.path.splitext(os.path.basename(path))[0]
+        if issuer.startswith("analysis_"):
+            continue
+        migrated[issuer] = store.write(issuer, read_history_csv(path))
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the columnar issuer history store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="convert a folder of issuer CSV files")
+    migrate.add_argument("csv_dir")
+    migrate.add_argument("--root", default=DEFAULT_ROOT, help="store location (default: the shared data/history)")
+    load = commands.add_parser("load", help="time a cold load of the whole market")
+    load.add_argument("--root", default=DEFAULT_ROOT)
+    load.add_argument("--max-open-files", type=int,
+                      help="lower the open file limit first, to check that loading does not hold files open")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = HistoryStore(args.root)
+        start_time = time.time()
+        migrated = migrate_csv_dir(args.csv_dir, store)
+        print(f"Migrated {len(migrated)} issuers ({sum(migrated.values())} rows) "
+              f"into {store.root} in {time.time() - start_time:.2f} seconds")
+    elif args.command == "load":
+        if args.max_open_files:
+            import resource
+            resource.setrlimit(resource.RLIMIT_NOFILE, (args.max_open_files, resource.getrlimit(resource.RLIMIT_NOFILE)[1]))
+        store = HistoryStore(args.root)
+        start_time = time.perf_counter()
+        market = store.load_market()
+        rows = sum(len(columns["date"]) for columns in market.values())
+        print(f"Loaded {len(market)} issuers ({rows} rows) in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Incremental indicator state, so a daily update only processes the new trading days.
+
+IndicatorState keeps, for every issuer, what mse.indicators.analyze needs to carry on from
+the last analysed day: the EMA and Wilder averages, the window tails behind the rolling
+sums / extremes, the running OBV and the previous MACD histogram. Each issuer's state is
+saved in its store directory (<ISSUER>/indicators_<period>.npz) with the last analysed
+date, the number of market trading days and of the issuer's own rows up to that date, so
+appending N days costs O(N) instead of a recomputation from row 0.
+
+    python -m mse.streaming verify [--root data/history] [--days 20]
+
+replays the last --days trading days through the streaming path and checks that every
+indicator and signal matches a full recomputation.
+"""
+import argparse
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from mse import indicators
+from mse.indicators import (BOLLINGER_K, FAST, SIGNAL, SLOW, STOCH_D, STOCH_K, WINDOW, bollinger_signals,
+                            combined_signals, macd_signals, rsi_from_averages, rsi_signals, stochastic_signals,
+                            window_sum)
+from mse.storage import DEFAULT_ROOT, HistoryStore
+
+FIELDS = ["date", "last", "max", "min", "quantity"]
+# Rows of each input kept in the window tails
+CLOSE_TAIL = max(FAST, SLOW, WINDOW)
+EMAS = ["ema_fast", "ema_slow", "ema_window", "macd_signal", "avg_gain", "avg_loss"]
+
+
+def _tail(values, n):
+    """
+    The last n rows of a 2-D array, padded with NaN at the top when there are fewer.
+    """
+    tail = np.full((n, values.shape[1]), np.nan)
+    if len(values):
+        tail[n - min(n, len(values)):] = values[-n:]
+    return tail
+
+
+def _mean(tail, n):
+    return window_sum(tail[-n:], n)[0] / n
+
+
+def _push(tail, row):
+    tail[:-1] = tail[1:]
+    tail[-1] = row
+
+
+def _ewm_step(state, row, seed, alpha):
+    """
+    One step of indicators.ewm: seed when the first full window arrives, then
+    state + alpha * (row - state) on every valid row. Returns the output for the row.
+    """
+    step = (row - state) * alpha
+    state[:] = np.where(np.isnan(state), seed, np.where(np.isnan(row), state, state + step))
+    return np.where(np.isnan(row), np.nan, state)
+
+
+class IndicatorState:
+    def __init__(self, issuers, period=14, last_date=None, days=0, rows=None, arrays=None):
+        self.issuers = list(issuers)
+        self.period = period
+        self.last_date = last_date
+        self.days = days
+        self.rows = rows if rows is not None else np.zeros(len(self.issuers), dtype="i8")
+        count = len(self.issuers)
+        self.arrays = arrays or {
+            "close": np.full((CLOSE_TAIL, count), np.nan),
+            "high": np.full((STOCH_K, count), np.nan),
+            "low": np.full((STOCH_K, count), np.nan),
+            "volume": np.full((WINDOW, count), np.nan),
+            "gain": np.full((period, count), np.nan),
+            "loss": np.full((period, count), np.nan),
+            "macd": np.full((SIGNAL, count), np.nan),
+            "percent_k": np.full((STOCH_D, count), np.nan),
+            "obv": np.zeros(count),
+            "histogram": np.full(count, np.nan),
+            **{name: np.full(count, np.nan) for name in EMAS},
+        }
+
+    @classmethod
+    def from_history(cls, issuers, close, high, low, volume, period=14):
+        """
+        Run the batch analysis over full dates x issuers matrices and keep the state after the last row.
+        Returns (state, results).
+        """
+        results = indicators.analyze(close, high, low, volume, period)
+        close = indicators.ffill(close)
+        high = np.where(np.isnan(high), close, high)
+        low = np.where(np.isnan(low), close, low)
+        delta = indicators.diff(close)
+        last = {name: matrix[-1] if len(matrix) else np.full(len(issuers), np.nan)
+                for name, matrix in results.items()}
+        arrays = {
+            "close": _tail(close, CLOSE_TAIL),
+            "high": _tail(high, STOCH_K),
+            "low": _tail(low, STOCH_K),
+            "volume": _tail(volume, WINDOW),
+            "gain": _tail(np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0)), period),
+            "loss": _tail(np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0)), period),
+            "macd": _tail(results["MACD"], SIGNAL),
+            "percent_k": _tail(results["Stoch_K"], STOCH_D),
+            "obv": np.nan_to_num(last["OBV"]),
+            "histogram": last["MACD_Hist"].copy(),
+            "ema_fast": last[f"EMA_{FAST}"].copy(),
+            "ema_slow": last[f"EMA_{SLOW}"].copy(),
+            "ema_window": last[f"EMA_{WINDOW}"].copy(),
+            "macd_signal": last["MACD_Signal"].copy(),
+            "avg_gain": last[f"Avg_Gain_{period}"].copy(),
+            "avg_loss": last[f"Avg_Loss_{period}"].copy(),
+        }
+        return cls(issuers, period, arrays=arrays), results
+
+    def update(self, close, high, low, volume):
+        """
+        Feed new dates x issuers rows (same column order as self.issuers) through the
+        indicators and return {column name: matrix} for just those rows, exactly as
+        indicators.analyze would produce them over the full history.
+        """
+        a = self.arrays
+        period = self.period
+        out = []
+        for t in range(len(close)):
+            row_close = np.where(np.isnan(close[t]), a["close"][-1], close[t])
+            delta = row_close - a["close"][-1]
+            gain = np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0))
+            loss = np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0))
+            _push(a["close"], row_close)
+            _push(a["high"], np.where(np.isnan(high[t]), row_close, high[t]))
+            _push(a["low"], np.where(np.isnan(low[t]), row_close, low[t]))
+            _push(a["volume"], volume[t])
+            _push(a["gain"], gain)
+            _push(a["loss"], loss)
+
+            fast = _ewm_step(a["ema_fast"], row_close, _mean(a["close"], FAST), 2.0 / (FAST + 1))
+            slow = _ewm_step(a["ema_slow"], row_close, _mean(a["close"], SLOW), 2.0 / (SLOW + 1))
+            line = fast - slow
+            _push(a["macd"], line)
+            signal_line = _ewm_step(a["macd_signal"], line, _mean(a["macd"], SIGNAL), 2.0 / (SIGNAL + 1))
+            histogram = line - signal_line
+            avg_gain = _ewm_step(a["avg_gain"], gain, _mean(a["gain"], period), 1.0 / period)
+            avg_loss = _ewm_step(a["avg_loss"], loss, _mean(a["loss"], period), 1.0 / period)
+
+            mid = _mean(a["close"], WINDOW)
+            mean_sq = window_sum(np.square(a["close"][-WINDOW:]), WINDOW)[0] / WINDOW
+            std = np.sqrt(np.maximum(mean_sq - np.square(mid), 0.0))
+            upper, lower = mid + BOLLINGER_K * std, mid - BOLLINGER_K * std
+
+            highest, lowest = a["high"].max(axis=0), a["low"].min(axis=0)
+            price_range = highest - lowest
+            with np.errstate(divide="ignore", invalid="ignore"):
+                percent_k = np.where(price_range == 0, 50.0, 100.0 * (row_close - lowest) / price_range)
+            percent_k = np.where(np.isnan(price_range), np.nan, percent_k)
+            _push(a["percent_k"], percent_k)
+            percent_d = _mean(a["percent_k"], STOCH_D)
+
+            a["obv"] += np.nan_to_num(np.sign(delta) * volume[t])
+            average_volume = _mean(a["volume"], WINDOW)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(average_volume > 0, volume[t] / average_volume, np.nan)
+
+            previous_histogram = a["histogram"].copy()
+            a["histogram"] = histogram
+            rsi = rsi_from_averages(avg_gain, avg_loss)
+            signals = [
+                rsi_signals(rsi),
+                # Two-row histogram so the crossover sees the previous day
+                macd_signals(np.vstack([previous_histogram, histogram]))[1],
+                bollinger_signals(row_close, upper, lower),
+                stochastic_signals(percent_k, percent_d),
+            ]
+            out.append({
+                f"RSI_{period}": rsi,
+                f"RSI_SMA_{period}": rsi_from_averages(_mean(a["gain"], period), _mean(a["loss"], period)),
+                f"Avg_Gain_{period}": avg_gain,
+                f"Avg_Loss_{period}": avg_loss,
+                f"SMA_{WINDOW}": mid,
+                f"EMA_{FAST}": fast,
+                f"EMA_{WINDOW}": _ewm_step(a["ema_window"], row_close, mid, 2.0 / (WINDOW + 1)),
+                f"EMA_{SLOW}": slow,
+                "MACD": line,
+                "MACD_Signal": signal_line,
+                "MACD_Hist": histogram,
+                "BB_Mid": mid,
+                "BB_Upper": upper,
+                "BB_Lower": lower,
+                "Stoch_K": percent_k,
+                "Stoch_D": percent_d,
+                "OBV": np.where(np.isnan(row_close), np.nan, a["obv"]),
+                "Volume_Ratio": ratio,
+                f"Signal_{period}": signals[0],
+                "Signal": combined_signals(*signals),
+            })
+        if not out:
+            return {}
+        return {name: np.array([row[name] for row in out]) for name in out[0]}
+
+    # --- Persistence ---
+    @staticmethod
+    def path(store, issuer, period=14):
+        return store.path(issuer, f"indicators_{period}.npz")
+
+    def save(self, store):
+        """
+        Write every issuer's column of the state to its own file.
+        """
+        for column, issuer in enumerate(self.issuers):
+            path = self.path(store, issuer, self.period)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, period=self.period, last_date=np.datetime64(self.last_date, "D"), days=self.days,
+                         rows=self.rows[column], **{name: values[..., column] for name, values in self.arrays.items()})
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, store, issuer, period=14):
+        """
+        Read one issuer's saved state, or None when there is none.
+        """
+        try:
+            with np.load(cls.path(store, issuer, period)) as saved:
+                arrays = {name: saved[name][..., None] for name in saved.files
+                          if name not in ("period", "last_date", "days", "rows")}
+                return cls([issuer], int(saved["period"]), saved["last_date"][()], int(saved["days"]),
+                           np.array([saved["rows"]]), arrays)
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+    @classmethod
+    def stack(cls, states):
+        """
+        Combine single-issuer states with the same watermark into one vectorized state.
+        """
+        first = states[0]
+        arrays = {name: np.concatenate([state.arrays[name] for state in states], axis=-1) for name in first.arrays}
+        return cls([issuer for state in states for issuer in state.issuers], first.period, first.last_date,
+                   first.days, np.concatenate([state.rows for state in states]), arrays)
+
+
+def market_calendar(store, issuers=None):
+    """
+    The market's trading days: the union of the dates of `issuers` (default: every issuer).
+    """
+    market = store.load_market(["date"])
+    wanted = None if issuers is None else set(issuers)
+    dates = [columns["date"] for issuer, columns in market.items() if wanted is None or issuer in wanted]
+    return np.unique(np.concatenate(dates)) if dates else np.empty(0, dtype="M8[D]")
+
+
+def analyze_issuers(store, issuers, calendar, period=14, rebuild=()):
+    """
+    Bring the indicators of `issuers` up to the last day of `calendar` and save their state.
+
+    Yields (dates, issuers, results, full) per group: issuers with a valid saved state only get
+    the days after their last analysed date; the rest (no state, listed in `rebuild`, or the
+    calendar / their history changed before that date) are recomputed over the whole calendar.
+    """
+    market = {issuer: store.read(issuer, FIELDS) for issuer in issuers}
+    groups = defaultdict(list)
+    for issuer in sorted(market):
+        state = None if issuer in rebuild else IndicatorState.load(store, issuer, period)
+        if (state is not None and state.period == period
+                and state.days == np.searchsorted(calendar, state.last_date, side="right")
+                and state.rows[0] == np.searchsorted(market[issuer]["date"], state.last_date, side="right")):
+            groups[state.last_date].append(state)
+        else:
+            groups[None].append(issuer)
+
+    for last_date, members in groups.items():
+        if last_date is None:
+            dates = calendar
+            _, codes, m = indicators.market_matrix({issuer: market[issuer] for issuer in members}, FIELDS[1:], dates)
+            state, results = IndicatorState.from_history(codes, m["last"], m["max"], m["min"], m["quantity"], period)
+        else:
+            state = IndicatorState.stack(members)
+            codes = state.issuers
+            dates = calendar[calendar > last_date]
+            _, _, m = indicators.market_matrix({issuer: market[issuer] for issuer in codes}, FIELDS[1:], dates)
+            results = state.update(m["last"], m["max"], m["min"], m["quantity"])
+        if not len(dates):
+            continue
+        state.last_date = dates[-1]
+        state.days = len(calendar)
+        state.rows = np.array([np.searchsorted(market[issuer]["date"], dates[-1], side="right") for issuer in codes])
+        state.save(store)
+        yield dates, codes, results, last_date is None
+
+
+def verify(store, days=20, period=14, issuers=None):
+    """
+    Split the market `days` trading days before its end, build the state from the first part
+    with the batch path, stream the rest and compare against a full recomputation.
+    Returns the names of the columns that differ (empty when everything matches).
+    """
+    market = store.load_market(FIELDS)
+    if issuers is not None:
+        market = {issuer: columns for issuer, columns in market.items() if issuer in set(issuers)}
+    dates, codes, m = indicators.market_matrix(market, FIELDS[1:])
+    split = max(len(dates) - days, 0)
+    matrices = [m[key] for key in FIELDS[1:]]
+    expected = indicators.analyze(*matrices, period=period)
+    state, _ = IndicatorState.from_history(codes, *[matrix[:split] for matrix in matrices], period=period)
+    streamed = state.update(*[matrix[split:] for matrix in matrices])
+    mismatched = []
+    for name, matrix in expected.items():
+        tail = matrix[split:]
+        if matrix.dtype.kind == "f":
+            same = np.array_equal(tail, streamed[name], equal_nan=True)
+        else:
+            same = np.array_equal(tail, streamed[name])
+        if not same:
+            mismatched.append(name)
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check streaming indicator updates against a full recomputation.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("verify", help="replay the last days through the streaming path")
+    check.add_argument("--root", default=DEFAULT_ROOT)
+    check.add_argument("--days", type=int, default=20)
+    check.add_argument("--period", type=int, default=14)
+    args = parser.parse_args()
+
+    mismatched = verify(HistoryStore(args.root), args.days, args.period)
+    if mismatched:
+        print(f"Streaming results differ from a full recomputation in: {', '.join(mismatched)}")
+        raise SystemExit(1)
+    print(f"Streaming results for the last {args.days} days match a full recomputation")
+
+
+if __name__ == "__main__":
+    main()
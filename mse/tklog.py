@@ -0,0 +1,75 @@
+"""
+Thread-safe log sink for the Tk text widgets of the GUIs.
+
+Tk widgets may only be touched from the thread running the main loop, yet the scrapers log
+from their worker threads. TkLogSink.write() only puts the message on a queue, so a worker
+never waits for the UI; the main loop drains the queue every `interval_ms` with after() and
+inserts everything that arrived as one block. The widget keeps the last `max_lines` lines
+and drops older ones, so a long run neither freezes the window nor grows it without bound.
+"""
+import queue
+import tkinter as tk
+
+MAX_LINES = 2000
+INTERVAL_MS = 100
+BATCH = 1000  # messages inserted per drain; the rest follow on the next idle turn
+
+
+class TkLogSink:
+    def __init__(self, widget, max_lines=MAX_LINES, interval_ms=INTERVAL_MS, batch=BATCH):
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.batch = batch
+        self._queue = queue.SimpleQueue()
+        self._lines = 0
+        self.widget.after(self.interval_ms, self._drain)
+
+    def write(self, message):
+        """
+        Queue a message for the widget; safe to call from any thread.
+        """
+        self._queue.put(str(message))
+
+    def call(self, fn, *args):
+        """
+        Run fn(*args) on the Tk thread, in order with the queued messages (e.g. a messagebox).
+        """
+        self._queue.put((fn, args))
+
+    def _drain(self):
+        lines = []
+        pending = True
+        try:
+            for _ in range(self.batch):
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    pending = False
+                    break
+                if isinstance(item, tuple):
+                    self._insert(lines)
+                    lines = []
+                    fn, args = item
+                    fn(*args)
+                else:
+                    lines.extend(item.split("\n"))
+            self._insert(lines)
+        finally:
+            # Scheduled even when a callback raised, so one error does not stop the log
+            try:
+                self.widget.after(1 if pending else self.interval_ms, self._drain)
+            except tk.TclError:
+                pass  # the window was closed
+
+    def _insert(self, lines):
+        if not lines:
+            return
+        lines = lines[-self.max_lines:]
+        self.widget.insert(tk.END, "\n".join(lines) + "\n")
+        self._lines += len(lines)
+        excess = self._lines - self.max_lines
+        if excess > 0:
+            self.widget.delete("1.0", f"{excess + 1}.0")
+            self._lines -= excess
+        self.widget.see(tk.END)
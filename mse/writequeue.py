@@ -0,0 +1,72 @@
+"""
+Per-issuer serialized writer for the history store.
+
+Request handlers submit rows and get a Future back. Rows for the same issuer are written by
+one drain at a time, and everything that queued up while the previous append was running is
+combined into a single HistoryStore.merge, so concurrent requests neither interleave their
+writes nor pay one file append each. Requests may commit in any order: merge() also inserts
+dates before the watermark, which an append would drop. A Future resolves once the rows are
+committed (fsynced data files and manifest) with {"added": n, "duplicates": m} for its own
+rows, where duplicates are rows whose date was already stored or sent earlier in the batch,
+or with the merge's exception.
+"""
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from mse.storage import frame_dates
+
+
+class WriteQueue:
+    def __init__(self, store, max_workers=4):
+        self.store = store
+        self._pending = defaultdict(list)
+        self._draining = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.requests = self.batches = 0
+
+    def submit(self, issuer, frame):
+        """
+        Queue a DataFrame of rows (scraper column names) for an issuer.
+        """
+        future = Future()
+        with self._lock:
+            self._pending[issuer].append((frame, future))
+            self.requests += 1
+            if issuer in self._draining:
+                return future
+            self._draining.add(issuer)
+        self._executor.submit(self._drain, issuer)
+        return future
+
+    def _drain(self, issuer):
+        while True:
+            with self._lock:
+                batch = self._pending.pop(issuer, [])
+                if not batch:
+                    self._draining.discard(issuer)
+                    return
+                self.batches += 1
+            try:
+                added = self.store.merge(issuer, pd.concat([frame for frame, _ in batch], ignore_index=True))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            # Each added date is credited to the first request of the batch that sent it
+            remaining = set(added.tolist())
+            for frame, future in batch:
+                own = remaining.intersection(frame_dates(frame).tolist())
+                remaining -= own
+                future.set_result({"added": len(own), "duplicates": len(frame) - len(own)})
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "batches": self.batches,
+                    "queued": sum(len(batch) for batch in self._pending.values())}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
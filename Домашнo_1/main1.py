@@ -1,12 +1,28 @@
+import argparse
 import os
+import sys
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup as BS
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import metrics, profiling
+from mse.cache import ResponseCache
+from mse.client import create_session
+from mse.manifest import plan_updates
+from mse.pagination import iter_page_records
+from mse.panel import Panel
+from mse.parsing import parse_issuers
+from mse.storage import HistoryStore
+
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{}"
+store = HistoryStore()
+NUM_THREADS = 16
+# One keep-alive pool shared by all workers; each worker may also have a next page in flight
+session = create_session(pool_size=NUM_THREADS * 2)
+# Pages of closed years are served from disk; the current year expires after a TTL
+cache = ResponseCache()
 
 
 def fetch_issuer_list():
@@ -14,67 +30,25 @@ def fetch_issuer_list():
     Retrieve a list of issuers (company codes) available on the Macedonian Stock Exchange.
     Filters out options that contain numbers.
     """
-    response = requests.get(BASE_URL.format("ADIN"))
-    soup = BS(response.content, 'html.parser')
-    option_elements = soup.select("#Code > option")
-    issuers = [opt.text.strip() for opt in option_elements if not any(char.isdigit() for char in opt.text)]
-    return issuers
+    with metrics.timed("issuer_list"):
+        response = session.get(BASE_URL.format("ADIN"))
+    return parse_issuers(response.content)
 
 
 def get_last_recorded_date(issuer_code):
     """
-    Retrieve the most recent date of recorded data for a given issuer from the existing CSV file.
-    If no file is found, return None to indicate no prior data exists.
+    Retrieve the most recent date of recorded data for a given issuer from the history store.
+    If the issuer has no stored rows, return None to indicate no prior data exists.
     """
-    try:
-        df = pd.read_csv(f"data/{issuer_code}.csv")
-        if df.empty:
-            return None
-        return pd.to_datetime(df['Date'].max())
-    except FileNotFoundError:
-        return None
-
-
-def parse_row(row):
-    """
-    Extracts and organizes data from a table row element (HTML <tr>) to a structured dictionary.
-    """
-    cells = row.select("td")
-    return {
-        "Date": cells[0].text.strip(),
-        "Year": cells[0].text.strip().split(".")[2],
-        "Month": cells[0].text.strip().split(".")[1],
-        "Price for Last Transaction": cells[1].text.strip(),
-        "Max Price": cells[2].text.strip(),
-        "Min Price": cells[3].text.strip(),
-        "Average Price": cells[4].text.strip(),
-        "% Change": cells[5].text.strip(),
-        "Quantity": cells[6].text.strip(),
-        "Market Volume (MKD)": cells[7].text.strip(),
-        "Total Volume": cells[8].text.strip()
-    }
+    return store.last_date(issuer_code)
 
 
 def retrieve_page_data(session, url, payload):
     """
-    Fetch data for a single page given a session, URL, and payload.
-    Handles recursive pagination if a 'Next' button is available.
+    Fetch data for all pages of a query given a session, URL, and payload.
+    Pages are followed iteratively, with the next page requested while the current one is parsed.
     """
-    response = session.post(url, data=payload)
-    if response.status_code != 200:
-        print(f"Failed to retrieve data. Status code: {response.status_code}")
-        return []
-
-    soup = BS(response.content, 'html.parser')
-    rows = soup.select("#resultsTable > tbody > tr")
-    records = [parse_row(row) for row in rows]
-
-    next_button = soup.select_one(".next > a")
-    if next_button:
-        next_url = next_button.get("href")
-        records.extend(retrieve_page_data(session, next_url, payload))
-
-    return records
+    return list(iter_page_records(session, url, payload, cache=cache))
 
 
 def gather_annual_data(issuer_code, year):
@@ -86,9 +60,7 @@ def gather_annual_data(issuer_code, year):
 
     print(f"Collecting data for {issuer_code} in {year}...")
 
-    with requests.Session() as session:
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
+    data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
 
     return data[::-1]  
 
@@ -106,30 +78,62 @@ def update_issuer_data(issuer_code):
             all_data.extend(year_data)
 
         df_new = pd.DataFrame(all_data)
-        output_file = f"data/{issuer_code}.csv"
-        if os.path.exists(output_file):
-            df_existing = pd.read_csv(output_file)
-            df_combined = pd.concat([df_existing, df_new], ignore_index=True)
-        else:
-            df_combined = df_new
-        df_combined.to_csv(output_file, encoding="utf-8-sig", index=False)
+        if df_new.empty:
+            print(f"No new data for {issuer_code}.")
+            return
+        store.append(issuer_code, df_new)
         print(f"Data for {issuer_code} saved successfully.")
 
     except Exception as e:
         print(f"Failed to update data for {issuer_code}: {e}")
 
 
-def main():
-    issuer_codes = fetch_issuer_list()
-    num_threads = 16  
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        executor.map(update_issuer_data, issuer_codes)
+def main(profiler=profiling.OFF):
+    with profiler.stage("issuer_list"):
+        issuer_codes = fetch_issuer_list()
+        # Only issuers whose watermark is behind the last trading day need fetching
+        plan = plan_updates(store.manifest, issuer_codes)
+    print(f"{len(issuer_codes) - len(plan)} issuers are up to date, updating {len(plan)}.")
+    with profiler.stage("scrape"):
+        with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+            executor.map(update_issuer_data, plan)
+    # Keep the aligned dates x issuers panel in step with the store
+    with profiler.stage("panel"):
+        print(f"Panel updated with {Panel(store).update()} new trading days.")
+
+
+def main_async(max_in_flight=32, per_host=8, profiler=profiling.OFF):
+    """
+    Drop-in replacement for main() that schedules every issuer-year on one asyncio event loop,
+    with a global limit on requests in flight and a per-host connection limit.
+    """
+    from mse import engine
+    with profiler.stage("scrape"):
+        stats = engine.run(store=store, base_url=BASE_URL, max_in_flight=max_in_flight, per_host=per_host,
+                           cache=cache)
+    with profiler.stage("panel"):
+        print(f"Panel updated with {Panel(store).update()} new trading days.")
+    return stats
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scrape issuer history from the Macedonian Stock Exchange.")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="async engine: global request limit")
+    parser.add_argument("--per-host", type=int, default=8, help="async engine: connections per host")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
     start_time = time.time()
     if not os.path.exists('data'):
         os.makedirs('data')
-    main()
+    with profiling.from_args("main1", args) as profiler:
+        if args.engine == "async":
+            main_async(args.max_in_flight, args.per_host, profiler)
+        else:
+            main(profiler)
     elapsed_time = (time.time() - start_time) / 60
     print(f"Total runtime: {elapsed_time:.2f} minutes")
+    print(metrics.summary())
+    if profiler.run_dir:
+        print(f"Profile written to {profiler.run_dir}")
@@ -2,31 +2,46 @@ import threading
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import os
+import sys
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup as BS
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from mse import metrics
+from mse.cache import ResponseCache
+from mse.client import create_session
+from mse.manifest import plan_updates
+from mse.pagination import iter_page_records
+from mse.panel import Panel
+from mse.parsing import parse_issuers
+from mse.storage import HistoryStore
+from mse.tklog import TkLogSink
+
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{}"
+store = HistoryStore()
+NUM_THREADS = 16
+# One keep-alive pool shared by all workers; each worker may also have a next page in flight
+session = create_session(pool_size=NUM_THREADS * 2)
+# Pages of closed years are served from disk; the current year expires after a TTL
+cache = ResponseCache()
 
 # --- Scraping Functions ---
 def fetch_issuer_list():
     try:
-        response = requests.get(BASE_URL.format("ADIN"), headers={"User-Agent": "Mozilla/5.0"})
+        with metrics.timed("issuer_list"):
+            response = session.get(BASE_URL.format("ADIN"))
         if response.status_code != 200:
             log(f"Failed to fetch issuer list. HTTP Status: {response.status_code}")
             return []
 
-        soup = BS(response.content, 'html.parser')
-        option_elements = soup.select("#Code > option")
+        issuers = parse_issuers(response.content)
 
-        if not option_elements:
+        if not issuers:
             log("No issuer options found on the page.")
             return []
 
-        issuers = [opt.text.strip() for opt in option_elements if not any(char.isdigit() for char in opt.text)]
         log(f"Fetched issuers: {issuers}")
         return issuers
 
@@ -35,46 +50,10 @@ def fetch_issuer_list():
         return []
 
 def get_last_recorded_date(issuer_code):
-    try:
-        df = pd.read_csv(f"data/{issuer_code}.csv")
-        if df.empty:
-            return None
-        return pd.to_datetime(df['Date'].max())
-    except FileNotFoundError:
-        return None
-
-def parse_row(row):
-    cells = row.select("td")
-    return {
-        "Date": cells[0].text.strip(),
-        "Year": cells[0].text.strip().split(".")[2],
-        "Month": cells[0].text.strip().split(".")[1],
-        "Price for Last Transaction": cells[1].text.strip(),
-        "Max Price": cells[2].text.strip(),
-        "Min Price": cells[3].text.strip(),
-        "Average Price": cells[4].text.strip(),
-        "% Change": cells[5].text.strip(),
-        "Quantity": cells[6].text.strip(),
-        "Market Volume (MKD)": cells[7].text.strip(),
-        "Total Volume": cells[8].text.strip()
-    }
+    return store.last_date(issuer_code)
 
 def retrieve_page_data(session, url, payload):
-    response = session.post(url, data=payload)
-    if response.status_code != 200:
-        log(f"Failed to retrieve data. Status code: {response.status_code}")
-        return []
-
-    soup = BS(response.content, 'html.parser')
-    rows = soup.select("#resultsTable > tbody > tr")
-    records = [parse_row(row) for row in rows]
-
-    next_button = soup.select_one(".next > a")
-    if next_button:
-        next_url = next_button.get("href")
-        records.extend(retrieve_page_data(session, next_url, payload))
-
-    return records
+    return list(iter_page_records(session, url, payload, cache=cache))
 
 def gather_annual_data(issuer_code, year):
     payload = {
@@ -85,9 +64,7 @@ def gather_annual_data(issuer_code, year):
 
     log(f"Collecting data for {issuer_code} in {year}...")
 
-    with requests.Session() as session:
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
+    data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
 
     return data[::-1]
 
@@ -103,13 +80,10 @@ def update_issuer_data(issuer_code):
             all_data.extend(year_data)
 
         df_new = pd.DataFrame(all_data)
-        output_file = f"data/{issuer_code}.csv"
-        if os.path.exists(output_file):
-            df_existing = pd.read_csv(output_file)
-            df_combined = pd.concat([df_existing, df_new], ignore_index=True)
-        else:
-            df_combined = df_new
-        df_combined.to_csv(output_file, encoding="utf-8-sig", index=False)
+        if df_new.empty:
+            log(f"No new data for {issuer_code}.")
+            return
+        store.append(issuer_code, df_new)
         log(f"Data for {issuer_code} saved successfully.")
 
     except Exception as e:
@@ -120,14 +94,18 @@ def main():
     if not issuer_codes:
         log("No issuer codes found. Exiting.")
         return
-    num_threads = 16
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        executor.map(update_issuer_data, issuer_codes)
+    # Only issuers whose watermark is behind the last trading day need fetching
+    plan = plan_updates(store.manifest, issuer_codes)
+    log(f"{len(issuer_codes) - len(plan)} issuers are up to date, updating {len(plan)}.")
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        executor.map(update_issuer_data, plan)
+    # Keep the aligned dates x issuers panel in step with the store
+    log(f"Panel updated with {Panel(store).update()} new trading days.")
 
 # --- GUI Code ---
 def log(message):
-    log_area.insert(tk.END, message + "\n")
-    log_area.see(tk.END)
+    # Called from worker threads; the Tk main loop inserts queued messages in batches
+    log_sink.write(message)
 
 def start_scraping_thread():
     thread = threading.Thread(target=start_scraping)
@@ -136,12 +114,14 @@ def start_scraping_thread():
 def start_scraping():
     log("Starting scraping...")
     start_time = time.time()
+    metrics.reset()
     if not os.path.exists('data'):
         os.makedirs('data')
     main()
     elapsed_time = (time.time() - start_time) / 60
     log(f"Scraping completed in {elapsed_time:.2f} minutes")
-    messagebox.showinfo("Success", f"Scraping completed in {elapsed_time:.2f} minutes")
+    log(metrics.summary())
+    log_sink.call(messagebox.showinfo, "Success", f"Scraping completed in {elapsed_time:.2f} minutes")
 
 def login():
     username = username_entry.get()
@@ -155,7 +135,7 @@ def login():
         messagebox.showerror("Login Failed", "Invalid username or password!")
 
 def show_scraping_interface():
-    global log_area
+    global log_sink
     scraping_window = tk.Tk()
     scraping_window.title("Scraping Interface")
 
@@ -165,6 +145,7 @@ def show_scraping_interface():
     # Add the log area below the button
     log_area = scrolledtext.ScrolledText(scraping_window, wrap=tk.WORD, height=15, width=80, font=("Courier", 10))
     log_area.pack(pady=10)
+    log_sink = TkLogSink(log_area)
 
     scraping_window.mainloop()
 
@@ -2,33 +2,55 @@ import threading
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import os
+import sys
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup as BS
 from concurrent.futures import ThreadPoolExecutor
 import time
 import matplotlib.pyplot as plt
-import schedule
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import metrics
+from mse.cache import ResponseCache
+from mse.charts import TrendCache
+from mse.client import create_session
+from mse.framecache import FrameCache
+from mse.manifest import plan_updates
+from mse.pagination import iter_page_records
+from mse.panel import Panel
+from mse.parsing import parse_issuers
+from mse.scheduler import ScrapeScheduler
+from mse.storage import HistoryStore
+from mse.tklog import TkLogSink
 
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{}"
+store = HistoryStore()
+NUM_THREADS = 16
+# One keep-alive pool shared by all workers; each worker may also have a next page in flight
+session = create_session(pool_size=NUM_THREADS * 2)
+# Pages of closed years are served from disk; the current year expires after a TTL
+cache = ResponseCache()
+# Parsed issuer frames for the filter button, dropped when an issuer is updated
+frames = FrameCache(store)
+# Price series decimated to the chart width, kept until the issuer's data changes
+trends = TrendCache(store)
+CHART_WIDTH, CHART_HEIGHT, CHART_DPI = 1200, 600, 100  # pixels
 
 # --- Scraping Functions ---
 def fetch_issuer_list():
     try:
-        response = requests.get(BASE_URL.format("ADIN"), headers={"User-Agent": "Mozilla/5.0"})
+        with metrics.timed("issuer_list"):
+            response = session.get(BASE_URL.format("ADIN"))
         if response.status_code != 200:
             log(f"Failed to fetch issuer list. HTTP Status: {response.status_code}")
             return []
 
-        soup = BS(response.content, 'html.parser')
-        option_elements = soup.select("#Code > option")
+        issuers = parse_issuers(response.content)
 
-        if not option_elements:
+        if not issuers:
             log("No issuer options found on the page.")
             return []
 
-        issuers = [opt.text.strip() for opt in option_elements if not any(char.isdigit() for char in opt.text)]
         log(f"Fetched issuers: {issuers}")
         return issuers
 
@@ -37,46 +59,10 @@ def fetch_issuer_list():
         return []
 
 def get_last_recorded_date(issuer_code):
-    try:
-        df = pd.read_csv(f"data/{issuer_code}.csv")
-        if df.empty:
-            return None
-        return pd.to_datetime(df['Date'].max())
-    except FileNotFoundError:
-        return None
-
-def parse_row(row):
-    cells = row.select("td")
-    return {
-        "Date": cells[0].text.strip(),
-        "Year": cells[0].text.strip().split(".")[2],
-        "Month": cells[0].text.strip().split(".")[1],
-        "Price for Last Transaction": cells[1].text.strip(),
-        "Max Price": cells[2].text.strip(),
-        "Min Price": cells[3].text.strip(),
-        "Average Price": cells[4].text.strip(),
-        "% Change": cells[5].text.strip(),
-        "Quantity": cells[6].text.strip(),
-        "Market Volume (MKD)": cells[7].text.strip(),
-        "Total Volume": cells[8].text.strip()
-    }
+    return store.last_date(issuer_code)
 
 def retrieve_page_data(session, url, payload):
-    response = session.post(url, data=payload)
-    if response.status_code != 200:
-        log(f"Failed to retrieve data. Status code: {response.status_code}")
-        return []
-
-    soup = BS(response.content, 'html.parser')
-    rows = soup.select("#resultsTable > tbody > tr")
-    records = [parse_row(row) for row in rows]
-
-    next_button = soup.select_one(".next > a")
-    if next_button:
-        next_url = next_button.get("href")
-        records.extend(retrieve_page_data(session, next_url, payload))
-
-    return records
+    return list(iter_page_records(session, url, payload, cache=cache))
 
 def gather_annual_data(issuer_code, year):
     payload = {
@@ -87,13 +73,12 @@ def gather_annual_data(issuer_code, year):
 
     log(f"Collecting data for {issuer_code} in {year}...")
 
-    with requests.Session() as session:
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
+    data = retrieve_page_data(session, BASE_URL.format(issuer_code), payload)
 
     return data[::-1]
 
 def update_issuer_data(issuer_code):
+    # Returns True once the issuer is up to date; the scheduler retries it otherwise
     try:
         last_date = get_last_recorded_date(issuer_code)
         start_date = datetime(2014, 11, 3) if not last_date else last_date + timedelta(days=1)
@@ -105,31 +90,34 @@ def update_issuer_data(issuer_code):
             all_data.extend(year_data)
 
         df_new = pd.DataFrame(all_data)
-        output_file = f"data/{issuer_code}.csv"
-        if os.path.exists(output_file):
-            df_existing = pd.read_csv(output_file)
-            df_combined = pd.concat([df_existing, df_new], ignore_index=True)
-        else:
-            df_combined = df_new
-        df_combined.to_csv(output_file, encoding="utf-8-sig", index=False)
+        if df_new.empty:
+            log(f"No new data for {issuer_code}.")
+            return True
+        store.append(issuer_code, df_new)
         log(f"Data for {issuer_code} saved successfully.")
+        return True
 
     except Exception as e:
         log(f"Failed to update data for {issuer_code}: {e}")
+        return False
 
 def main():
     issuer_codes = fetch_issuer_list()
     if not issuer_codes:
         log("No issuer codes found. Exiting.")
         return
-    num_threads = 16
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        executor.map(update_issuer_data, issuer_codes)
+    # Only issuers whose watermark is behind the last trading day need fetching
+    plan = plan_updates(store.manifest, issuer_codes)
+    log(f"{len(issuer_codes) - len(plan)} issuers are up to date, updating {len(plan)}.")
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        executor.map(update_issuer_data, plan)
+    # Keep the aligned dates x issuers panel in step with the store
+    log(f"Panel updated with {Panel(store).update()} new trading days.")
 
 # --- GUI Code ---
 def log(message):
-    log_area.insert(tk.END, message + "\n")
-    log_area.see(tk.END)
+    # Called from worker threads; the Tk main loop inserts queued messages in batches
+    log_sink.write(message)
 
 def start_scraping_thread():
     thread = threading.Thread(target=start_scraping)
@@ -138,12 +126,14 @@ def start_scraping_thread():
 def start_scraping():
     log("Starting scraping...")
     start_time = time.time()
+    metrics.reset()
     if not os.path.exists('data'):
         os.makedirs('data')
     main()
     elapsed_time = (time.time() - start_time) / 60
     log(f"Scraping completed in {elapsed_time:.2f} minutes")
-    messagebox.showinfo("Success", f"Scraping completed in {elapsed_time:.2f} minutes")
+    log(metrics.summary())
+    log_sink.call(messagebox.showinfo, "Success", f"Scraping completed in {elapsed_time:.2f} minutes")
 
 def login():
     username = username_entry.get()
@@ -157,13 +147,13 @@ def login():
         messagebox.showerror("Login Failed", "Invalid username or password!")
 
 def show_scraping_interface():
-    global log_area, issuer_entry, start_date_entry, end_date_entry
+    global log_sink, issuer_entry, start_date_entry, end_date_entry
 
     scraping_window = tk.Tk()
     scraping_window.title("Scraping Interface")
 
     tk.Label(scraping_window, text="Welcome to the Scraping Tool", font=("Arial", 16)).pack(pady=10)
-    tk.Label(scraping_window, text="Issuer Code", font=("Arial", 14)).pack(pady=5)
+    tk.Label(scraping_window, text="Issuer Code (comma-separated to compare)", font=("Arial", 14)).pack(pady=5)
     issuer_entry = tk.Entry(scraping_window, font=("Arial", 14))
     issuer_entry.pack(pady=5)
 
@@ -177,10 +167,12 @@ def show_scraping_interface():
 
     tk.Button(scraping_window, text="Filter Data", font=("Arial", 14), command=filter_data).pack(pady=10)
     tk.Button(scraping_window, text="Start Scraping", font=("Arial", 14), command=start_scraping_thread).pack(pady=10)
-    tk.Button(scraping_window, text="View Trends", font=("Arial", 14), command=lambda: plot_trends(issuer_entry.get())).pack(pady=10)
+    tk.Button(scraping_window, text="Schedule Daily Updates", font=("Arial", 14), command=start_scheduled_scraping).pack(pady=10)
+    tk.Button(scraping_window, text="View Trends", font=("Arial", 14), command=lambda: plot_trends(issuer_entry.get(), start_date_entry.get(), end_date_entry.get())).pack(pady=10)
 
     log_area = scrolledtext.ScrolledText(scraping_window, wrap=tk.WORD, height=15, width=80, font=("Courier", 10))
     log_area.pack(pady=10)
+    log_sink = TkLogSink(log_area)
 
     scraping_window.mainloop()
 
@@ -198,11 +190,8 @@ def filter_data():
 
 def filter_by_issuer_and_date(issuer_code, start_date, end_date):
     try:
-        df = pd.read_csv(f"data/{issuer_code}.csv")
-        df['Date'] = pd.to_datetime(df['Date'], format="%d.%m.%Y")
-        mask = (df['Date'] >= pd.to_datetime(start_date)) & (df['Date'] <= pd.to_datetime(end_date))
-        filtered_df = df[mask]
-        return filtered_df
+        # Binary search over the cached, sorted frame; repeated clicks do not touch the files
+        return frames.range(issuer_code, start_date, end_date)
     except Exception as e:
         log(f"Error filtering data: {e}")
         return pd.DataFrame()
@@ -213,56 +202,54 @@ def display_filtered_data(filtered_data):
     else:
         log("No data found for the selected filter.")
 
-def plot_trends(issuer_code):
+def plot_trends(issuer_codes, start_date="", end_date=""):
+    issuers = [code.strip() for code in issuer_codes.split(",") if code.strip()]
     try:
-        df = pd.read_csv(f"data/{issuer_code}.csv")
-        df['Date'] = pd.to_datetime(df['Date'], format="%d.%m.%Y")
-        df.sort_values(by="Date", inplace=True)
-
-        # Log initial price values to check their format
-        log(f"Initial Price Data for {issuer_code}:\n{df['Price for Last Transaction'].head()}")
-
-        # Clean the price data (replace commas with periods and remove non-numeric characters)
-        df['Price for Last Transaction'] = df['Price for Last Transaction'].replace({',': '.'}, regex=True)  # Replace commas with periods
-        df['Price for Last Transaction'] = df['Price for Last Transaction'].str.replace(r'[^\d.]', '', regex=True)  # Remove non-numeric characters
-
-        # Log cleaned price data
-        log(f"Cleaned Price Data for {issuer_code}:\n{df['Price for Last Transaction'].head()}")
-
-        # Convert the cleaned price column to float, coercing errors to NaN
-        df['Price for Last Transaction'] = pd.to_numeric(df['Price for Last Transaction'], errors='coerce')
-
-        # Log after conversion to numeric
-        log(f"Numeric Price Data for {issuer_code}:\n{df['Price for Last Transaction'].head()}")
-
-        # Check if there are valid data points left after cleaning
-        if df['Price for Last Transaction'].isna().all():
-            log(f"No valid data found for {issuer_code}.")
+        # Typed prices straight from the store, cut down to about one point per pixel of width
+        series = trends.many(issuers, start_date or None, end_date or None, CHART_WIDTH)
+        series = {issuer: points for issuer, points in series.items() if len(points[1])}
+        for issuer in issuers:
+            if issuer not in series:
+                log(f"No valid data found for {issuer}.")
+        if not series:
             return
 
-        # Plotting the price trend
-        plt.figure(figsize=(10, 6))
-        plt.plot(df['Date'], df['Price for Last Transaction'], label='Last Transaction Price')
-        plt.title(f"Price Trend for {issuer_code}")
+        # Several issuers are compared on one scale: each line starts at 100 on its first
+        # nonzero price, as a price of 0 cannot be rebased
+        rebase = len(series) > 1
+        if rebase:
+            for issuer, (dates, prices) in list(series.items()):
+                nonzero = prices.nonzero()[0]
+                if len(nonzero) == 0:
+                    log(f"Skipping {issuer}: every price in the range is 0.")
+                    del series[issuer]
+                else:
+                    series[issuer] = (dates[nonzero[0]:], prices[nonzero[0]:])
+            if not series:
+                return
+        plt.figure(figsize=(CHART_WIDTH / CHART_DPI, CHART_HEIGHT / CHART_DPI), dpi=CHART_DPI)
+        for issuer, (dates, prices) in series.items():
+            plt.plot(dates, prices / prices[0] * 100 if rebase else prices, label=issuer, linewidth=1)
+        plt.title("Price Trends (first day = 100)" if rebase else f"Price Trend for {next(iter(series))}")
         plt.xlabel('Date')
-        plt.ylabel('Price (MKD)')
+        plt.ylabel('Price (first day = 100)' if rebase else 'Price (MKD)')
         plt.xticks(rotation=45)
-        plt.legend()
+        plt.legend(ncol=max(1, len(series) // 10))
         plt.tight_layout()
         plt.show()
 
     except Exception as e:
-        log(f"Error plotting trends for {issuer_code}: {e}")
+        log(f"Error plotting trends for {issuer_codes}: {e}")
 
 # --- Automated Data Update ---
 def schedule_scraping():
-    while True:
-        log("Scheduled scraping started...")
-        start_scraping()
-        time.sleep(86400)  # Sleep for 24 hours
+    # Runs once per trading session after the close and only fetches the issuers that miss it
+    log("Scheduled scraping started...")
+    scheduler = ScrapeScheduler(store, update_issuer_data, fetch_issuer_list, log=log)
+    scheduler.run_forever()
 
 def start_scheduled_scraping():
-    thread = threading.Thread(target=schedule_scraping)
+    thread = threading.Thread(target=schedule_scraping, daemon=True)
     thread.start()
 
 login_window = tk.Tk()
@@ -1,31 +1,44 @@
+import argparse
 import threading
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
 import pandas as pd
-import requests
 import os
-from bs4 import BeautifulSoup as BS
+import sys
 from datetime import datetime, timedelta
 import time  # Import time for performance analysis
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import indicators, metrics, pipeline, profiling
+from mse.cache import ResponseCache
+from mse.client import create_session
+from mse.pagination import iter_page_records
+from mse.parsing import parse_issuers
+from mse.storage import HistoryStore
+from mse.tklog import TkLogSink
+
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{}"
-DATA_DIR = "data"  # Folder where the CSV files are saved
+DATA_DIR = "data"  # Folder where the analysis CSV files are saved
+store = HistoryStore()
+session = create_session(pool_size=2)
+# Past periods are served from disk after the first run
+cache = ResponseCache()
+PROFILE = None  # parsed --profile options, None when profiling is off
 
 def fetch_issuer_list():
     try:
-        response = requests.get(BASE_URL.format("ADIN"), headers={"User-Agent": "Mozilla/5.0"})
+        with metrics.timed("issuer_list"):
+            response = session.get(BASE_URL.format("ADIN"))
         if response.status_code != 200:
             log(f"Failed to fetch issuer list. HTTP Status: {response.status_code}")
             return []
 
-        soup = BS(response.content, 'html.parser')
-        option_elements = soup.select("#Code > option")
+        issuers = parse_issuers(response.content)
 
-        if not option_elements:
+        if not issuers:
             log("No issuer options found on the page.")
             return []
 
-        issuers = [opt.text.strip() for opt in option_elements if not any(char.isdigit() for char in opt.text)]
         log(f"Fetched issuers: {issuers}")
         return issuers
 
@@ -40,70 +53,48 @@ def fetch_stock_data(issuer_code):
             'FromDate': '01.01.2014',
             'ToDate': '31.12.2024'
         }
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        response = session.post(BASE_URL.format(issuer_code), data=payload)
-        
-        if response.status_code != 200:
-            log(f"Failed to retrieve data for {issuer_code}. Status code: {response.status_code}")
+        # Follow every result page; the old single POST only ever saw the first one
+        records = list(iter_page_records(session, BASE_URL.format(issuer_code), payload, cache=cache))
+        if not records:
+            log(f"Failed to retrieve data for {issuer_code}.")
             return None
 
-        soup = BS(response.content, 'html.parser')
-        rows = soup.select("#resultsTable > tbody > tr")
-        
-        data = []
-        for row in rows:
-            cells = row.select("td")
-            record = {
-                "Date": cells[0].text.strip(),
-                "Price for Last Transaction": float(cells[1].text.strip().replace(",", "")),
-                "Max Price": float(cells[2].text.strip().replace(",", "")),
-                "Min Price": float(cells[3].text.strip().replace(",", "")),
-                "Average Price": float(cells[4].text.strip().replace(",", "")),
-                "% Change": cells[5].text.strip(),
-                "Quantity": int(cells[6].text.strip().replace(",", "")),
-                "Market Volume (MKD)": cells[7].text.strip(),
-                "Total Volume": int(cells[8].text.strip().replace(",", ""))
-            }
-            data.append(record)
-        
-        return pd.DataFrame(data)
+        return pd.DataFrame(records)
 
     except Exception as e:
         log(f"Error fetching stock data for {issuer_code}: {e}")
         return None
 
-def calculate_rsi(data, period=14):
-    delta = data['Price for Last Transaction'].diff()
-    gain = delta.where(delta > 0, 0)
-    loss = -delta.where(delta < 0, 0)
-    avg_gain = gain.rolling(window=period, min_periods=1).mean()
-    avg_loss = loss.rolling(window=period, min_periods=1).mean()
-    rs = avg_gain / avg_loss
-    return 100 - (100 / (1 + rs))
+def calculate_rsi(data, period=14, method="wilder"):
+    prices = data['Price for Last Transaction'].to_numpy(dtype=float)
+    return pd.Series(indicators.rsi(prices, period, method), index=data.index)
 
 def generate_signals(data, period=14):
-    signals = []
-    for index, row in data.iterrows():
-        rsi_signal = 'Buy' if row[f'RSI_{period}'] < 30 else ('Sell' if row[f'RSI_{period}'] > 70 else 'Hold')
-        signals.append(rsi_signal)
-    data[f'Signal_{period}'] = signals
+    data[f'Signal_{period}'] = indicators.rsi_signals(data[f'RSI_{period}'].to_numpy())
     return data
 
 def log(message):
-    log_area.insert(tk.END, message + "\n")
-    log_area.see(tk.END)
+    # Called from worker threads; the Tk main loop inserts queued messages in batches
+    log_sink.write(message)
 
 def start_scraping_thread():
     thread = threading.Thread(target=start_scraping)
     thread.start()
 
 def start_scraping():
+    with profiling.from_args("time_analisys", PROFILE) as profiler:
+        scrape_and_analyze(profiler)
+    if profiler.run_dir:
+        log(f"Profile written to {profiler.run_dir}")
+
+def scrape_and_analyze(profiler=profiling.OFF):
     # Start of time analysis
     start_time = time.time()  # Record the start time
+    metrics.reset()
     log("Starting scraping and analysis...")
 
-    issuer_codes = fetch_issuer_list()
+    with profiler.stage("issuer_list"):
+        issuer_codes = fetch_issuer_list()
     if not issuer_codes:
         log("No issuer codes found. Exiting.")
         return
@@ -111,43 +102,62 @@ def start_scraping():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
+    with profiler.stage("scrape"):
+        scrape_missing(issuer_codes)
+
+    with profiler.stage("analysis"):
+        analyze(issuer_codes)
+
+    # End of time analysis
+    elapsed_time = (time.time() - start_time) / 60  # Calculate elapsed time in minutes
+    log(f"Scraping and analysis completed in {elapsed_time:.2f} minutes.")
+    log(metrics.summary())
+    log_sink.call(messagebox.showinfo, "Success", f"Scraping and analysis completed in {elapsed_time:.2f} minutes!")
+
+def scrape_missing(issuer_codes):
     for issuer in issuer_codes:
         log(f"Checking data for {issuer}...")
-        file_path = f"{DATA_DIR}/{issuer}.csv"
 
-        if os.path.exists(file_path):
+        if store.exists(issuer):
             log(f"Data for {issuer} already exists. Skipping scraping.")
-            data = pd.read_csv(file_path)
         else:
             log(f"Data for {issuer} not found. Starting scraping...")
             data = fetch_stock_data(issuer)
             if data is None:
                 log(f"Failed to scrape data for {issuer}.")
                 continue
-            data.to_csv(file_path, index=False)
+            store.write(issuer, data)
             log(f"Data for {issuer} scraped and saved.")
 
-        data['RSI_14'] = calculate_rsi(data)
-        data = generate_signals(data)
-
-        data.to_csv(f"{DATA_DIR}/analysis_{issuer}.csv", index=False)
-        log(f"Analysis for {issuer} completed and saved.")
-    
-    # End of time analysis
-    elapsed_time = (time.time() - start_time) / 60  # Calculate elapsed time in minutes
-    log(f"Scraping and analysis completed in {elapsed_time:.2f} minutes.")
-    messagebox.showinfo("Success", f"Scraping and analysis completed in {elapsed_time:.2f} minutes!")
+def analyze(issuer_codes):
+    # The indicators run headless on a process pool (one worker per core); only the trading
+    # days since the last run are analysed and appended. Results are logged here as they arrive.
+    updated = 0
+    for issuer, rows, recomputed in pipeline.run(store, issuer_codes, DATA_DIR):
+        updated += 1
+        if recomputed:
+            log(f"Analysis for {issuer} completed and saved.")
+        else:
+            log(f"Analysis for {issuer} updated with {rows} new rows.")
+    if updated == 0:
+        log("Analysis is already up to date.")
 
 def show_scraping_interface():
-    global log_area
+    global log_sink
     scraping_window = tk.Tk()
     scraping_window.title("Scraping Tool")
 
     log_area = scrolledtext.ScrolledText(scraping_window, wrap=tk.WORD, height=15, width=80, font=("Courier", 10))
     log_area.pack(pady=10)
+    log_sink = TkLogSink(log_area)
 
     tk.Button(scraping_window, text="Start Scraping and Analyze", font=("Arial", 14), command=start_scraping_thread).pack(pady=10)
 
     scraping_window.mainloop()
 
-show_scraping_interface()
+if __name__ == "__main__":
+    # Guarded so the analysis worker processes can import this module without opening a window
+    parser = argparse.ArgumentParser(description="Scrape missing issuers and run the technical analysis.")
+    profiling.add_arguments(parser)
+    PROFILE = parser.parse_args()
+    show_scraping_interface()
@@ -1,10 +1,69 @@
 from flask import Flask, jsonify, request
-import requests
-from bs4 import BeautifulSoup as BS
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import metrics
+from mse.cache import ResponseCache
+from mse.client import create_session
+from mse.pagination import iter_page_records
+from mse.parsing import DATE_FORMAT, FIELDS
+from mse.singleflight import ResultCache, SingleFlight
 
 app = Flask(__name__)
+metrics.instrument_app(app, "annual_data_service")
 
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/{issuer_code}"
+MAX_WORKERS = 16
+# The current year keeps changing; its results are reused for this many seconds
+CURRENT_YEAR_TTL = 600
+# Parsed issuer-years kept in memory; closed years are also on disk, so older ones are dropped
+RESULT_CACHE_ENTRIES = 512
+# Flask serves requests from several threads; they all share this keep-alive pool
+session = create_session(pool_size=MAX_WORKERS * 2)
+# Closed years never change on mse.mk, so their pages are kept on disk for good
+cache = ResponseCache()
+# Concurrent requests for the same (issuer, year) share one upstream fetch
+flights = SingleFlight()
+results = ResultCache(max_entries=RESULT_CACHE_ENTRIES)
+# Fans the pairs of a batch request out to the upstream site
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+def fetch_annual_data(issuer_code, year):
+    payload = {
+        'Code': issuer_code,
+        'FromDate': f"01.01.{year}",
+        'ToDate': f"31.12.{year}"
+    }
+    # Every result page of the year, not only the first one; a failed page raises PageError,
+    # so a partial year is never cached
+    records = list(iter_page_records(session, BASE_URL.format(issuer_code=issuer_code), payload, cache=cache))
+    return [to_json_row(record) for record in records]
+
+def to_json_row(record):
+    """
+    Every column of a scraped row, so clients store the same records as the scrapers. The last
+    price keeps its short "Price" name; days without trades have no max / min, sent as null
+    rather than NaN, which is not valid JSON.
+    """
+    row = {"Date": record["Date"].strftime(DATE_FORMAT)}
+    for column, key, _ in FIELDS[1:]:
+        value = record[column]
+        row["Price" if key == "last" else column] = None if isinstance(value, float) and math.isnan(value) else value
+    return row
+
+def get_annual_data_cached(issuer_code, year):
+    key = (issuer_code, int(year))
+    data = results.get(key)
+    if data is None:
+        # Judged before the fetch: a year that ends while it is being fetched may miss its last days
+        final = int(year) < datetime.now().year
+        data = flights.do(key, fetch_annual_data, issuer_code, int(year))
+        results.put(key, data, None if final else CURRENT_YEAR_TTL)
+    return data
 
 @app.route('/annual_data', methods=['POST'])
 def get_annual_data():
@@ -16,23 +75,32 @@ def get_annual_data():
         return jsonify({"error": "Missing parameters"}), 400
 
     try:
-        payload = {
-            'Code': issuer_code,
-            'FromDate': f"01.01.{year}",
-            'ToDate': f"31.12.{year}"
-        }
-        response = requests.post(BASE_URL.format(issuer_code=issuer_code), data=payload)
-
-        if response.status_code != 200:
-            return jsonify([])
-
-        soup = BS(response.content, 'html.parser')
-        rows = soup.select("#resultsTable > tbody > tr")
-        data = [{"Date": row.select("td")[0].text.strip(), "Price": row.select("td")[1].text.strip()} for row in rows]
-
-        return jsonify(data)
+        return jsonify(get_annual_data_cached(issuer_code, year))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/annual_data/batch', methods=['POST'])
+def get_annual_data_batch():
+    """
+    Body: {"requests": [{"issuer_code": "ALK", "year": 2024}, ...]}
+    Answer: {"results": [{"issuer_code": "ALK", "year": 2024, "data": [...]}, ...]} in request order;
+    a pair that failed carries "error" instead of "data".
+    """
+    pairs = (request.get_json() or {}).get('requests')
+    if not pairs or any(not pair.get('issuer_code') or not pair.get('year') for pair in pairs):
+        return jsonify({"error": "Missing parameters"}), 400
+
+    futures = [executor.submit(get_annual_data_cached, pair['issuer_code'], pair['year']) for pair in pairs]
+    answers = []
+    for pair, future in zip(pairs, futures):
+        answer = {"issuer_code": pair['issuer_code'], "year": pair['year']}
+        try:
+            answer["year"] = int(pair['year'])
+            answer["data"] = future.result()
+        except Exception as e:
+            answer["error"] = str(e)
+        answers.append(answer)
+    return jsonify({"results": answers})
+
 if __name__ == "__main__":
-    app.run(port=5002)
+    app.run(port=5002, threaded=True)
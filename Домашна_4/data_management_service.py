@@ -1,18 +1,83 @@
 from flask import Flask, request, jsonify
+import gzip
+import hashlib
+import json
 import os
+import re
+import sys
+from urllib.parse import urlencode
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import export, metrics
+from mse.parsing import DTYPES, FIELDS, parse_dates, parse_numbers
+from mse.storage import HistoryStore, to_day
+from mse.writequeue import WriteQueue
+
 app = Flask(__name__)
+metrics.instrument_app(app, "data_management_service")
+
+# Rows of one issuer collected from a bulk upload before they are handed to the writer
+BULK_FLUSH_ROWS = 5000
+# Rows per /history page when the client does not ask for a limit, and the most it may ask for
+HISTORY_PAGE = 1000
+HISTORY_MAX_PAGE = 10000
+# Bodies smaller than this are sent uncompressed
+GZIP_MIN_BYTES = 1024
+FORMATS = {"json": export.JSON, "csv": export.CSV, "arrow": export.ARROW}
+# Dates are sent the way mse.mk shows them; day and month are not always zero padded
+DATE_PATTERN = re.compile(r"\d{1,2}\.\d{1,2}\.\d{4}$")
+store = HistoryStore()
+# Writes for the same issuer are serialized and concurrent requests are batched into one merge
+writer = WriteQueue(store)
+
+def check_dates(rows):
+    """
+    Raise ValueError unless every row is an object with a dd.mm.yyyy Date.
+    """
+    for row in rows:
+        date = row.get('Date') if isinstance(row, dict) else None
+        if not isinstance(date, str) or not DATE_PATTERN.match(date.strip()):
+            raise ValueError(f"Invalid date {date!r}, expected dd.mm.yyyy")
+
+def to_numbers(values):
+    """
+    float64 of one posted column. JSON numbers are taken as they are and only strings are read
+    as MK-locale text, so "2.0" next to 2.5 in the same column does not become 20.
+    """
+    is_text = values.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+    try:
+        numbers = pd.to_numeric(values.mask(is_text), errors="raise").to_numpy(dtype="f8", copy=True)
+        if is_text.any():
+            numbers[is_text] = parse_numbers(values[is_text].to_numpy())
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid number in {values.name!r}") from None
+    return numbers
 
-DATA_FOLDER = "data"
+def to_frame(data):
+    """
+    DataFrame of posted rows with parsed dates and float64 numbers; raises ValueError for rows
+    the store cannot take.
+    """
+    check_dates(data)
+    # Rows from the annual data service carry the last price under "Price"
+    frame = pd.DataFrame(data).rename(columns={"Price": "Price for Last Transaction"})
+    try:
+        frame["Date"] = parse_dates(frame["Date"].to_numpy())
+    except ValueError:
+        raise ValueError("Invalid date, expected dd.mm.yyyy") from None
+    # Converted here, per request: once blocks of several requests are concatenated, a column
+    # of numbers from one and strings from another would all be parsed as text
+    for column, _, _ in FIELDS[1:]:
+        if column in frame:
+            frame[column] = to_numbers(frame[column])
+    return frame
 
-def save_data(issuer, data):
-    file_path = os.path.join(DATA_FOLDER, f"{issuer}.csv")
-    df = pd.DataFrame(data)
-    if os.path.exists(file_path):
-        df_existing = pd.read_csv(file_path)
-        df = pd.concat([df_existing, df], ignore_index=True)
-    df.to_csv(file_path, index=False, encoding="utf-8-sig")
+def save_data(issuer, frame):
+    """
+    Queue the rows and wait until they are committed; returns {"added": n, "duplicates": m}.
+    """
+    return writer.submit(issuer, frame).result()
 
 @app.route('/save_data', methods=['POST'])
 def save_data_endpoint():
@@ -20,14 +85,166 @@ def save_data_endpoint():
     issuer = data.get('issuer')
     data_values = data.get('data')
 
-    if not issuer or not data_values:
+    if not issuer or not isinstance(data_values, list) or not data_values:
         return jsonify({"error": "Missing parameters"}), 400
 
     try:
-        save_data(issuer, data_values)
-        return jsonify({"message": f"Data for {issuer} saved successfully!"})
+        frame = to_frame(data_values)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = save_data(issuer, frame)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    # Rows of dates that were already stored are counted as duplicates, not saved again
+    return jsonify(dict(result, message=f"Data for {issuer} saved: {result['added']} new rows, "
+                                        f"{result['duplicates']} duplicates."))
+
+@app.route('/save_data/bulk', methods=['POST'])
+def save_data_bulk_endpoint():
+    """
+    Newline-delimited JSON, read as it streams in. Every line is either one row,
+    {"issuer": "ALK", "Date": "08.11.2024", "Price": 23299.0}, or a block of rows,
+    {"issuer": "ALK", "data": [{"Date": ..., "Price": ...}, ...]}.
+    The answer is sent once every row has been durably committed. Reading stops at the first
+    invalid line, or the first block of an issuer whose rows cannot be converted, with a 400;
+    the rows of the other issuers are still saved, "added" and "duplicates" in the answer count
+    them per issuer and "invalid" names the issuers whose rows were rejected.
+    """
+    rows = {}
+    in_flight = {}
+    added, duplicates, failures, invalid = {}, {}, {}, {}
+    received = 0
+    error = None
+
+    def wait(issuer):
+        try:
+            result = in_flight.pop(issuer).result()
+        except Exception as e:
+            failures[issuer] = str(e)
+            return
+        added[issuer] = added.get(issuer, 0) + result["added"]
+        duplicates[issuer] = duplicates.get(issuer, 0) + result["duplicates"]
+
+    def flush(issuer):
+        # One block per issuer in flight: the previous one is committed before the next is
+        # queued, which bounds memory and keeps the blocks from being merged into one count
+        if issuer in in_flight:
+            wait(issuer)
+        try:
+            frame = to_frame(rows.pop(issuer))
+        except ValueError as e:
+            # e.g. a date that matches dd.mm.yyyy but does not exist
+            invalid[issuer] = str(e)
+            return False
+        in_flight[issuer] = writer.submit(issuer, frame)
+        return True
+
+    for line_number, line in enumerate(request.stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            issuer = record.pop('issuer')
+            block = record['data'] if 'data' in record else [record]
+            check_dates(block)
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            error = f"Invalid record on line {line_number}: {e}"
+            break
+        rows.setdefault(issuer, []).extend(block)
+        received += len(block)
+        if len(rows[issuer]) >= BULK_FLUSH_ROWS and not flush(issuer):
+            break
+    # Rows read before an invalid line are saved too, so the counts match what is stored
+    for issuer in list(rows):
+        flush(issuer)
+    for issuer in list(in_flight):
+        wait(issuer)
+
+    answer = {"received": received, "added": added, "duplicates": duplicates}
+    if invalid:
+        error = error or "Invalid rows for " + ", ".join(sorted(invalid))
+        answer.update(invalid=invalid)
+    if error or failures:
+        answer.update(error=error or "Some issuers could not be saved", failures=failures)
+        return jsonify(answer), 400 if error else 500
+    return jsonify(answer)
+
+def negotiate_format():
+    """
+    The explicit ?format= wins over the Accept header; JSON is the default.
+    """
+    offered = export.available_formats()
+    name = request.args.get('format')
+    if name:
+        mimetype = FORMATS.get(name)
+        return mimetype if mimetype in offered else None
+    if not request.accept_mimetypes:
+        return export.JSON
+    return request.accept_mimetypes.best_match(offered)
+
+@app.route('/history/<issuer>', methods=['GET'])
+def get_history(issuer):
+    """
+    Rows of one issuer dated within ?from= and ?to= (inclusive, ISO or dd.mm.yyyy), limited to
+    the comma-separated ?fields= (the date is always included). Pages hold ?limit= rows; the
+    next page is requested with ?cursor= set to the "next" value of the JSON body or the
+    Link header. The body is JSON, CSV or Arrow IPC depending on Accept / ?format=.
+    """
+    meta = store.meta(issuer)
+    if meta["rows"] == 0:
+        return jsonify({"error": f"No history for {issuer}"}), 404
+
+    requested = [field for field in request.args.get('fields', '').split(',') if field]
+    fields = ["date"] + [field for field in requested if field != "date"] if requested else list(DTYPES)
+    unknown = [field for field in fields if field not in DTYPES]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+    try:
+        start, end, cursor = (request.args.get(name) for name in ('from', 'to', 'cursor'))
+        start = to_day(start) if start else None
+        end = to_day(end) if end else None
+        if cursor:
+            start = to_day(cursor) if start is None else max(start, to_day(cursor))
+        limit = min(int(request.args.get('limit', HISTORY_PAGE)), HISTORY_MAX_PAGE)
+    except ValueError:
+        return jsonify({"error": "from, to and cursor must be dates and limit a number"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    mimetype = negotiate_format()
+    if mimetype is None:
+        return jsonify({"error": "Supported formats: " + ", ".join(export.available_formats())}), 406
+    compress = "gzip" in request.accept_encodings
+
+    # The manifest checksums change with every write, so the tag is known before any data is read
+    tag = json.dumps([issuer, meta["rows"], [meta["checksums"].get(field) for field in fields],
+                      sorted(request.args.items(multi=True)), mimetype, compress])
+    etag = hashlib.sha1(tag.encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    rows = store.row_range(issuer, start, end)
+    page = slice(rows.start, min(rows.stop, rows.start + limit))
+    columns = {key: values[page] for key, values in store.read(issuer, fields).items()}
+    following = None
+    if page.stop < rows.stop:
+        following = str(store.read(issuer, ["date"])["date"][page.stop])
+
+    body = export.encode(columns, mimetype, issuer=issuer, next=following)
+    response = app.response_class(body, mimetype=mimetype)
+    if compress and len(body) >= GZIP_MIN_BYTES:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    if following:
+        args = dict(request.args.to_dict(), cursor=following)
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
 
 if __name__ == "__main__":
-    app.run(port=5003)
+    app.run(port=5003, threaded=True)
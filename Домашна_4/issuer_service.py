@@ -1,10 +1,93 @@
-from flask import Flask, jsonify
-import requests
-from bs4 import BeautifulSoup as BS
+from flask import Flask, jsonify, request
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import metrics
+from mse.client import create_session
+from mse.parsing import parse_issuers
+from mse.paths import data_path
+from mse.singleflight import SingleFlight
 
 app = Flask(__name__)
+metrics.instrument_app(app, "issuer_service")
 
 BASE_URL = "https://www.mse.mk/mk/stats/symbolhistory/ADIN"
+session = create_session(pool_size=4)
+# The issuer list changes a few times a year; after the TTL the stale list is still served
+# while a background refresh fetches the new one
+ISSUERS_TTL = 24 * 3600
+RETRY_AFTER = 60  # seconds between refresh attempts while mse.mk is failing
+# Next to the response cache, not inside it: every entry of data/cache is an issuer folder
+CACHE_PATH = data_path("issuers.json")
+
+flights = SingleFlight()
+_lock = threading.Lock()
+_state = {"issuers": None, "body": None, "etag": None, "fetched_at": 0.0, "attempted_at": 0.0}
+
+def _publish(issuers, fetched_at):
+    body = json.dumps(issuers).encode("utf-8")
+    with _lock:
+        _state.update(issuers=issuers, body=body, etag=hashlib.sha1(body).hexdigest(), fetched_at=fetched_at)
+
+def load_cached_issuers():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            saved = json.load(f)
+        _publish(saved["issuers"], saved["fetched_at"])
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+
+def fetch_issuers():
+    with _lock:
+        _state["attempted_at"] = time.time()
+    with metrics.timed("issuer_list"):
+        response = session.get(BASE_URL)
+    if response.status_code != 200:
+        raise RuntimeError(f"mse.mk answered {response.status_code}")
+    issuers = parse_issuers(response.content)
+    if not issuers:
+        raise RuntimeError("No issuer options found on the page")
+
+    fetched_at = time.time()
+    _publish(issuers, fetched_at)
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp_path = f"{CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": fetched_at, "issuers": issuers}, f)
+    os.replace(tmp_path, CACHE_PATH)
+    return issuers
+
+def refresh_in_background():
+    def refresh():
+        try:
+            flights.do("issuers", fetch_issuers)
+        except Exception as e:
+            app.logger.warning(f"Refreshing the issuer list failed, serving the stale one: {e}")
+    threading.Thread(target=refresh, daemon=True).start()
+
+def get_cached_issuers():
+    """
+    Return the current state, fetching synchronously only when there is no list at all.
+    """
+    if _state["body"] is None:
+        load_cached_issuers()
+    if _state["body"] is None:
+        flights.do("issuers", fetch_issuers)
+    now = time.time()
+    with _lock:
+        expired = now - _state["fetched_at"] > ISSUERS_TTL
+        retry = now - _state["attempted_at"] > RETRY_AFTER
+        if expired and retry:
+            _state["attempted_at"] = now
+        state = dict(_state)
+    if expired and retry:
+        refresh_in_background()
+    return state
 
 @app.route('/', methods=['GET'])
 def index():
@@ -13,18 +96,16 @@ def index():
 @app.route('/issuers', methods=['GET'])
 def get_issuers():
     try:
-        response = requests.get(BASE_URL, headers={"User-Agent": "Mozilla/5.0"})
-        if response.status_code != 200:
-            return jsonify([])
-
-        soup = BS(response.content, 'html.parser')
-        option_elements = soup.select("#Code > option")
-
-        issuers = [opt.text.strip() for opt in option_elements if not any(char.isdigit() for char in opt.text)]
-        return jsonify(issuers)
+        state = get_cached_issuers()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    response = app.response_class(state["body"], mimetype="application/json")
+    response.set_etag(state["etag"])
+    response.headers["Cache-Control"] = "no-cache"
+    # Answers 304 Not Modified when If-None-Match carries the current ETag
+    return response.make_conditional(request)
+
 
 if __name__ == "__main__":
-    app.run(port=5001)
+    app.run(port=5001, threaded=True)
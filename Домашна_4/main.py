@@ -1,22 +1,39 @@
+import argparse
 import threading
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import os
+import sys
 import pandas as pd
-import requests
 from datetime import datetime
-from bs4 import BeautifulSoup as BS
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mse import metrics, profiling
+from mse.client import create_session
+from mse.manifest import plan_updates
+from mse.htmltable import extract_cells
+from mse.panel import Panel
+from mse.parsing import convert_cells, to_records
+from mse.storage import HistoryStore
+from mse.tklog import TkLogSink
+
 # --- Constants ---
 BASE_URL = "http://127.0.0.1:5001/{}"  # Pointing to Flask API (Flask app is running on port 5001)
+ANNUAL_DATA_URL = "http://127.0.0.1:5002"  # annual_data_service
+# A batch covers every issuer-year of a run, so allow it far longer than a single request
+BATCH_TIMEOUT = (5, 900)
 DATA_FOLDER = "data"
+MAX_WORKERS = 5
+PROFILE = None  # parsed --profile options, None when profiling is off
+store = HistoryStore()
 
 # --- Helper Functions ---
 def log_message(log_area, message):
-    log_area.insert(tk.END, message + "\n")
-    log_area.see(tk.END)
+    # log_area is a TkLogSink: safe to write from the worker threads, drained by the Tk main loop
+    log_area.write(message)
 
 def ensure_folder_exists(folder):
     if not os.path.exists(folder):
@@ -28,9 +45,13 @@ class DataFetchStrategy:
         raise NotImplementedError("Fetch method must be implemented.")
 
 class IssuerListStrategy(DataFetchStrategy):
+    def __init__(self, session):
+        self.session = session
+
     def fetch_data(self, log_area):
         try:
-            response = requests.get(BASE_URL.format("issuers"))
+            with metrics.timed("issuer_list"):
+                response = self.session.get(BASE_URL.format("issuers"))
             if response.status_code != 200:
                 log_message(log_area, f"Error fetching issuers: {response.status_code}")
                 return []
@@ -52,25 +73,65 @@ class AnnualDataStrategy(DataFetchStrategy):
         self.session = session
 
     def fetch_data(self, issuer_code, year):
+        """
+        Rows of one issuer-year, or None when the request failed.
+        """
         payload = {
             'Code': issuer_code,
             'FromDate': f"01.01.{year}",
             'ToDate': f"31.12.{year}"
         }
-        response = self.session.post(BASE_URL.format(f"symbolhistory/{issuer_code}"), data=payload)
+        with metrics.timed("fetch", issuer_code, year):
+            response = self.session.post(BASE_URL.format(f"symbolhistory/{issuer_code}"), data=payload)
         if response.status_code != 200:
-            return []
+            metrics.FAILURES.inc(stage="fetch", issuer=issuer_code, year=year)
+            return None
 
-        soup = BS(response.content, 'html.parser')
-        rows = soup.select("#resultsTable > tbody > tr")
-        return [self.parse_row(row) for row in rows]
+        with metrics.timed("parse", issuer_code, year):
+            rows = self.parse_rows(extract_cells(response.content))
+        metrics.ROWS.inc(len(rows), stage="parse", issuer=issuer_code, year=year)
+        return rows
 
-    def parse_row(self, row):
-        cells = row.select("td")
-        return {
-            "Date": cells[0].text.strip(),
-            "Price": cells[1].text.strip()
-        }
+    def parse_rows(self, cells):
+        # Full rows, like the scrapers store; a price-only row would leave the other columns empty
+        return to_records(convert_cells(cells))
+
+class AnnualDataBatchStrategy(DataFetchStrategy):
+    def __init__(self, session):
+        self.session = session
+
+    def fetch_data(self, plan, log_area):
+        """
+        Fetch every (issuer, year) of the plan with one POST /annual_data/batch.
+        Returns {issuer: rows}, or None when the batch endpoint cannot be used. Issuers with a
+        failed year are left out: appending their later years would move the watermark past
+        the missing one for good, so they are fetched again in full on the next run.
+        """
+        pairs = [{"issuer_code": issuer, "year": year} for issuer, (start_date, years) in plan.items() for year in years]
+        try:
+            with metrics.timed("batch"):
+                response = self.session.post(f"{ANNUAL_DATA_URL}/annual_data/batch", json={"requests": pairs},
+                                             timeout=BATCH_TIMEOUT)
+        except Exception as e:
+            log_message(log_area, f"Batch request failed: {e}")
+            return None
+        if response.status_code != 200:
+            log_message(log_area, f"Batch request failed: {response.status_code}")
+            return None
+
+        data = defaultdict(list)
+        failed = set()
+        for result in response.json()["results"]:
+            if "error" in result:
+                metrics.FAILURES.inc(stage="batch", issuer=result["issuer_code"], year=result["year"])
+                log_message(log_area, f"Failed to fetch {result['issuer_code']} {result['year']}: {result['error']}")
+                failed.add(result["issuer_code"])
+            else:
+                data[result["issuer_code"]].extend(result["data"])
+        for issuer in sorted(failed):
+            data.pop(issuer, None)
+            log_message(log_area, f"Nothing saved for {issuer} in this run.")
+        return data
 
 # --- Main Data Manager ---
 class DataManager:
@@ -85,48 +146,79 @@ class DataManager:
 
 # --- Scraping and Saving Functions ---
 def fetch_issuer_data(log_area):
+    with profiling.from_args("domashna4", PROFILE) as profiler:
+        update_issuers(log_area, profiler)
+    if profiler.run_dir:
+        log_message(log_area, f"Profile written to {profiler.run_dir}")
+
+def update_issuers(log_area, profiler=profiling.OFF):
     log_message(log_area, "Starting scraping...")
     start_time = time.time()
+    metrics.reset()
     ensure_folder_exists(DATA_FOLDER)
 
+    # One keep-alive pool, sized to the worker count, for every call of this run
+    session = create_session(pool_size=MAX_WORKERS)
+
     # Fetch issuer list via API
-    issuer_strategy = IssuerListStrategy()
+    issuer_strategy = IssuerListStrategy(session)
     manager = DataManager(issuer_strategy)
-    issuers = manager.execute(log_area)
+    with profiler.stage("issuer_list"):
+        issuers = manager.execute(log_area)
 
     if not issuers:
         log_message(log_area, "No issuers found.")
         return
 
-    # Prepare session and strategy for annual data
-    session = requests.Session()
-    session.headers.update({'User-Agent': 'Mozilla/5.0'})
-    annual_strategy = AnnualDataStrategy(session)
-    manager.set_strategy(annual_strategy)
-
-    # Using ThreadPoolExecutor for concurrent data fetching
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_issuer = {executor.submit(fetch_data_for_issuer, issuer, manager, log_area): issuer for issuer in issuers}
-        for future in future_to_issuer:
-            future.result()  # Wait for all tasks to complete
+    # The manifest tells which issuers are behind and from which year, without opening data files
+    plan = plan_updates(store.manifest, issuers)
+    log_message(log_area, f"{len(issuers) - len(plan)} issuers are up to date, updating {len(plan)}.")
+
+    # One batch call to the annual data service covers every issuer-year of the plan
+    batch = None
+    if plan and ANNUAL_DATA_URL:
+        manager.set_strategy(AnnualDataBatchStrategy(session))
+        with profiler.stage("fetch"):
+            batch = manager.execute(plan, log_area)
+    if batch is not None:
+        with profiler.stage("save"):
+            for issuer, data in batch.items():
+                if data:
+                    save_data(issuer, data)
+                    log_message(log_area, f"Data for {issuer} saved.")
+    else:
+        # Fall back to one request per issuer-year; fetching and saving interleave here
+        manager.set_strategy(AnnualDataStrategy(session))
+        with profiler.stage("fetch"):
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                future_to_issuer = {executor.submit(fetch_data_for_issuer, issuer, manager, log_area, years): issuer
+                                    for issuer, (start_date, years) in plan.items()}
+                for future in future_to_issuer:
+                    future.result()  # Wait for all tasks to complete
+    with profiler.stage("panel"):
+        log_message(log_area, f"Panel updated with {Panel(store).update()} new trading days.")
 
     elapsed_time = (time.time() - start_time) / 60
     log_message(log_area, f"Scraping completed in {elapsed_time:.2f} minutes.")
+    log_message(log_area, metrics.summary())
 
-def fetch_data_for_issuer(issuer, manager, log_area):
+def fetch_data_for_issuer(issuer, manager, log_area, years=None):
     log_message(log_area, f"Fetching data for {issuer}...")
-    for year in range(2014, datetime.now().year + 1):
-        data = manager.execute(issuer, year)
-        if data:
-            save_data(issuer, data)
+    # All years are saved together, and only if none failed, so a missing year is never skipped over
+    data = []
+    for year in years or range(2014, datetime.now().year + 1):
+        rows = manager.execute(issuer, year)
+        if rows is None:
+            log_message(log_area, f"Failed to fetch {issuer} {year}; nothing saved for {issuer} in this run.")
+            return
+        data.extend(rows)
+    if data:
+        save_data(issuer, data)
 
 def save_data(issuer, data):
-    file_path = os.path.join(DATA_FOLDER, f"{issuer}.csv")
-    df = pd.DataFrame(data)
-    if os.path.exists(file_path):
-        df_existing = pd.read_csv(file_path)
-        df = pd.concat([df_existing, df], ignore_index=True)
-    df.to_csv(file_path, index=False, encoding="utf-8-sig")
+    # The annual data service sends every column, with the last price under "Price"
+    df = pd.DataFrame(data).rename(columns={"Price": "Price for Last Transaction"})
+    store.append(issuer, df)
 
 # --- GUI Components ---
 def start_scraping_thread(log_area):
@@ -139,12 +231,16 @@ def create_gui():
 
     tk.Label(root, text="Scraping Application", font=("Arial", 16)).pack(pady=10)
 
-    log_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=15, width=80, font=("Courier", 10))
-    log_area.pack(pady=10)
+    log_widget = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=15, width=80, font=("Courier", 10))
+    log_widget.pack(pady=10)
+    log_area = TkLogSink(log_widget)
 
     tk.Button(root, text="Start Scraping", font=("Arial", 14), command=lambda: start_scraping_thread(log_area)).pack(pady=10)
 
     root.mainloop()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update issuer history through the Домашна_4 services.")
+    profiling.add_arguments(parser)
+    PROFILE = parser.parse_args()
     create_gui()